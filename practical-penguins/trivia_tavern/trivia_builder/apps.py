@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TriviaBuilderConfig(AppConfig):
     name = 'trivia_builder'
+
+    def ready(self):
+        import trivia_builder.signals  # noqa
@@ -0,0 +1,41 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+# rendered fragments are keyed by version so they never go stale, this only bounds how long unused ones linger
+CATALOG_TIMEOUT = 24 * 60 * 60
+
+
+def _version_key(pk=None):
+    return 'catalog:version' if pk is None else f'catalog:quiz:{pk}:version'
+
+
+def version(pk=None) -> float:
+    """when the catalog, or quiz 'pk' when given, last changed as a unix timestamp
+
+    The stamp lives in the django cache, an evicted stamp restarts at the
+    current time so everything rendered before it is simply ignored
+    """
+    stamp = cache.get(_version_key(pk))
+    if stamp is None:
+        cache.add(_version_key(pk), time.time(), CATALOG_TIMEOUT)
+        stamp = cache.get(_version_key(pk), time.time())
+    return stamp
+
+
+def touch(*pks):
+    """record that the quizzes 'pks' changed, which also changes every catalog page"""
+    now = time.time()
+    cache.set_many({_version_key(pk): now for pk in (None,) + pks}, CATALOG_TIMEOUT)
+
+
+def etag(request, pk=None):
+    """etag_func for the catalog pages, the page around the catalog shows who is logged in so it varies by user"""
+    page = f'{version(pk)!r}:{request.user.pk}:{request.get_full_path()}'
+    return hashlib.md5(page.encode()).hexdigest()
+
+
+def last_modified(request, pk=None):
+    return datetime.fromtimestamp(version(pk), timezone.utc)
@@ -1,4 +1,4 @@
-from django.forms import ModelForm
+from django.forms import BaseModelFormSet, FileField, Form, ModelChoiceField, ModelForm, Textarea, ValidationError
 from django.utils.translation import ugettext_lazy
 
 from trivia_builder.models import TriviaQuestion, TriviaQuiz
@@ -12,7 +12,40 @@ class TriviaQuestionForm(ModelForm):
 
     class Meta:
         model = TriviaQuestion
-        fields = ['question_text', 'question_answer']
+        fields = ['question_text', 'question_answer', 'match_mode', 'alternate_answers', 'numeric_tolerance']
+        widgets = {
+            'alternate_answers': Textarea(attrs={'rows': 2}),
+        }
+
+
+class LoadedObjectField(ModelChoiceField):
+    """the id field of a model formset, looked up among the objects the formset loaded
+    for its forms (BaseModelFormSet._existing_object) instead of with one query per form"""
+
+    def __init__(self, formset, *args, **kwargs):
+        self.formset = formset
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            obj = self.formset._existing_object(int(value))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return obj
+
+
+class BaseTriviaQuestionFormSet(BaseModelFormSet):
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        pk = self.model._meta.pk.name
+        field = form.fields[pk]
+        form.fields[pk] = LoadedObjectField(self, field.queryset, initial=field.initial, required=False,
+                                            widget=field.widget)
 
 
 class TriviaQuizForm(ModelForm):
@@ -27,3 +60,7 @@ class TriviaQuizForm(ModelForm):
         labels = {
             'name': ugettext_lazy('Trivia Pack Name'),
         }
+
+
+class PackUploadForm(Form):
+    pack_file = FileField(label=ugettext_lazy('Pack file (.jsonl or .csv)'))
@@ -0,0 +1,45 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from trivia_builder import matching
+
+SAMPLE_QUESTIONS = {
+    matching.EXACT: ('Tim Berners-Lee', []),
+    matching.NORMALIZED: ('Tim Berners-Lee', ['TimBL']),
+    matching.ACCENT_FOLDED: ('Pokémon', ['Pocket Monsters']),
+    matching.FUZZY: ('Mosaic Netscape', ['Netscape Navigator']),
+    matching.NUMERIC: ('1969', ['nineteen sixty nine']),
+}
+
+
+def typo(value, rng):
+    i = rng.randrange(len(value))
+    return value[:i] + value[i + 1:]
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark grading answers with every match mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', type=int, default=100000, help='answers graded per match mode')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['answers']
+        for mode, (answer, alternates) in SAMPLE_QUESTIONS.items():
+            # a realistic mix of right answers, sloppy right answers, typos and wrong answers
+            pool = [answer, answer.lower() + ' ', typo(answer, rng), 'no idea', 'Al Gore'] + alternates
+            answers = [rng.choice(pool) for _ in range(count)]
+
+            start = time.perf_counter()
+            matcher = matching.compile_answer_key(matching.answer_key(mode, [answer] + alternates, 1.0))
+            compiled = time.perf_counter()
+            correct = sum(map(matcher.matches, answers))
+            graded = time.perf_counter()
+
+            self.stdout.write(f'{mode:>10}: compiled in {(compiled - start) * 1e6:8.1f}us, '
+                              f'graded {count} answers in {graded - compiled:6.3f}s '
+                              f'({count / (graded - compiled):10.0f}/s, {correct} correct)')
@@ -0,0 +1,96 @@
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from trivia_builder.models import TriviaQuiz
+
+
+def question_data(prefix, index, question=None):
+    """the post data of question form 'index', 'question' is the pk of an existing question"""
+    return {
+        f'{prefix}-{index}-id': question or '',
+        f'{prefix}-{index}-question_text': f'Question {index}?',
+        f'{prefix}-{index}-question_answer': f'Answer {index}',
+        f'{prefix}-{index}-match_mode': 'exact',
+        f'{prefix}-{index}-alternate_answers': '',
+        f'{prefix}-{index}-numeric_tolerance': '0',
+    }
+
+
+def formset_data(questions, initial=0, prefix='form'):
+    """management form plus 'questions', a list of per question dicts"""
+    data = {
+        f'{prefix}-TOTAL_FORMS': str(len(questions)),
+        f'{prefix}-INITIAL_FORMS': str(initial),
+        f'{prefix}-MIN_NUM_FORMS': '1',
+        f'{prefix}-MAX_NUM_FORMS': '1000',
+    }
+    for question in questions:
+        data.update(question)
+    return data
+
+
+class Command(BaseCommand):
+    help = ('Benchmark authoring a big trivia pack through the create and edit pages: '
+            'creates a pack, then edits every question, deletes some and adds as many, and removes it again')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=500)
+        parser.add_argument('--max-queries', type=int, default=None,
+                            help='fail if saving the pack took more queries than this')
+
+    def handle(self, *args, **options):
+        count = options['questions']
+        # an author of its own, it is deleted with its packs at the end
+        host = User.objects.create(username=f'bench_quiz_authoring_{uuid.uuid4().hex[:12]}')
+        author = Client(HTTP_HOST='localhost')
+        author.force_login(host)
+        try:
+            data = formset_data([question_data('form', i) for i in range(count)])
+            data.update({'name': 'Big pack', 'description': 'bench_quiz_authoring'})
+            create = self.timed(author, reverse('quiz-create'), data)
+            quiz = TriviaQuiz.objects.get(author=host)
+            if quiz.question_count != count:
+                raise CommandError(f'created {quiz.question_count} of {count} questions')
+
+            # every question is edited, the first tenth deleted and as many added at the end
+            questions = list(quiz.triviaquestion_set.order_by('question_index').values_list('pk', flat=True))
+            dropped = max(1, count // 10) if count > 1 else 0
+            edits = []
+            for i, pk in enumerate(questions):
+                question = question_data('form', i, pk)
+                question[f'form-{i}-question_text'] = f'Edited question {i}?'
+                if i < dropped:
+                    question[f'form-{i}-DELETE'] = 'on'
+                edits.append(question)
+            edits += [question_data('form', i) for i in range(count, count + dropped)]
+            data = formset_data(edits, initial=count)
+            data.update({'name': 'Big pack', 'description': 'bench_quiz_authoring, edited'})
+            update = self.timed(author, reverse('quiz-update', kwargs={'pk': quiz.pk}), data)
+            quiz.refresh_from_db()
+            if quiz.question_count != count:
+                raise CommandError(f'the edited pack has {quiz.question_count} of {count} questions')
+        finally:
+            host.delete()
+
+        for name, (seconds, queries) in (('create', create), ('update', update)):
+            self.stdout.write(f'{name:>8}: {count} questions in {seconds * 1000:.1f}ms, {queries} queries')
+        budget = options['max_queries']
+        if budget is not None and max(create[1], update[1]) > budget:
+            raise CommandError(f'saving the pack took {max(create[1], update[1])} queries, the budget is {budget}')
+
+    @staticmethod
+    def timed(client, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.post(url, data)
+            seconds = time.perf_counter() - start
+        if response.status_code != 302:
+            raise CommandError(f'{url} did not save the pack: {response.status_code}')
+        return seconds, len(queries)
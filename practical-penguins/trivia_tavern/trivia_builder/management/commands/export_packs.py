@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from trivia_builder.models import TriviaQuiz
+from trivia_builder.packs import FORMATS, export_rows, format_for
+
+
+class Command(BaseCommand):
+    help = 'Export trivia packs as a JSON Lines or CSV pack file that import_packs reads back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="the pack file to write, '-' for stdout")
+        parser.add_argument('--author', default=None, help='only export the packs of this username')
+        parser.add_argument('--format', choices=sorted(FORMATS), default=None,
+                            help='file format, by default guessed from the file name')
+
+    def handle(self, *args, **options):
+        quizzes = TriviaQuiz.objects.all()
+        if options['author']:
+            quizzes = quizzes.filter(author__username=options['author'])
+        writer = FORMATS[options['format'] or format_for(options['path'])][1]
+        if options['path'] == '-':
+            for line in writer(export_rows(quizzes)):
+                self.stdout.write(line, ending='')
+            return
+        with open(options['path'], 'w', encoding='utf-8', newline='') as out:
+            out.writelines(writer(export_rows(quizzes)))
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from trivia_builder.packs import FORMATS, IMPORT_BATCH_SIZE, PACK_ENCODING, PackFileError, PackImporter, format_for
+
+
+class Command(BaseCommand):
+    help = ('Import trivia packs from a JSON Lines or CSV pack file (see trivia_builder/packs.py). Packs the '
+            'author already has are synced to the file. The import is written in batches, if a line is '
+            'rejected the batches before it stay imported and running the import again finishes the sync')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='the pack file')
+        parser.add_argument('--author', required=True, help='username that owns the imported packs')
+        parser.add_argument('--format', choices=sorted(FORMATS), default=None,
+                            help='file format, by default guessed from the file name')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='questions written per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(username=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f'there is no user {options["author"]}')
+        reader = FORMATS[options['format'] or format_for(options['path'])][0]
+        importer = PackImporter(author, batch_size=options['batch_size'])
+        try:
+            with open(options['path'], encoding=PACK_ENCODING, newline='') as lines:
+                importer.run(reader(lines))
+        except PackFileError as e:
+            raise CommandError(f'{options["path"]} {e}, {importer.questions} questions were imported before it')
+        self.stdout.write(f'imported {importer.questions} questions into {len(importer.packs)} packs')
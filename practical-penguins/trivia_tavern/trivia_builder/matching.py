@@ -0,0 +1,160 @@
+"""Answer matching for trivia questions
+
+Every TriviaQuestion picks a match mode. The question's answers (the main
+answer plus any alternates) are normalized once into an 'answer key' and
+compiled into a Matcher, so grading an answer is a set lookup, or for the
+fuzzy mode a set lookup followed by a bounded edit-distance check.
+"""
+import json
+import re
+import string
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, Type
+
+EXACT = 'exact'
+NORMALIZED = 'normalized'
+ACCENT_FOLDED = 'accent'
+FUZZY = 'fuzzy'
+NUMERIC = 'numeric'
+
+MATCH_MODE_CHOICES = [
+    (EXACT, 'Exact (ignoring case)'),
+    (NORMALIZED, 'Ignore punctuation and spacing'),
+    (ACCENT_FOLDED, 'Ignore punctuation, spacing and accents'),
+    (FUZZY, 'Allow small typos'),
+    (NUMERIC, 'Number within tolerance'),
+]
+
+MATCHERS: Dict[str, Type['Matcher']] = {}
+
+_PUNCTUATION = str.maketrans(string.punctuation, ' ' * len(string.punctuation))
+_WHITESPACE = re.compile(r'\s+')
+
+
+def register(mode):
+    def decorator(cls):
+        MATCHERS[mode] = cls
+        return cls
+    return decorator
+
+
+def normalize_exact(value: str) -> str:
+    return value.strip().upper()
+
+
+def normalize_punctuation(value: str) -> str:
+    return _WHITESPACE.sub(' ', value.translate(_PUNCTUATION)).strip().upper()
+
+
+def fold_accents(value: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', value)
+    return normalize_punctuation(''.join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+def within_distance(a: str, b: str, max_distance: int) -> bool:
+    """within_distance checks if the levenshtein distance between 'a' and 'b'
+    is at most 'max_distance', only the diagonal band of the table that can
+    stay under the limit is computed so the cost is O(max_distance * len(a))"""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        low = max(1, i - max_distance)
+        high = min(len(b), i + max_distance)
+        current = [max_distance + 1] * (len(b) + 1)
+        current[0] = i if i <= max_distance else max_distance + 1
+        for j in range(low, high + 1):
+            cost = 0 if char_a == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if min(current[low - 1:high + 1]) > max_distance:
+            return False
+        previous = current
+    return previous[len(b)] <= max_distance
+
+
+class Matcher:
+    """Matcher grades answers against a fixed set of accepted 'answers'
+    subclasses pick the normalization, the accepted set is normalized once
+    when the matcher is built. Nothing that normalizes to an empty string
+    (like '?!') is ever accepted"""
+    normalize = staticmethod(normalize_exact)
+
+    def __init__(self, answers: Iterable[str], tolerance: float = 0.0):
+        self.accepted = frozenset(filter(None, map(self.normalize, answers)))
+        self.tolerance = tolerance
+
+    def matches(self, value: str) -> bool:
+        value = self.normalize(value)
+        return bool(value) and value in self.accepted
+
+
+@register(EXACT)
+class ExactMatcher(Matcher):
+    pass
+
+
+@register(NORMALIZED)
+class NormalizedMatcher(Matcher):
+    normalize = staticmethod(normalize_punctuation)
+
+
+@register(ACCENT_FOLDED)
+class AccentFoldedMatcher(Matcher):
+    normalize = staticmethod(fold_accents)
+
+
+@register(FUZZY)
+class FuzzyMatcher(AccentFoldedMatcher):
+    """allows one typo per four characters of the answer, two at most"""
+    MAX_DISTANCE = 2
+
+    def __init__(self, answers, tolerance=0.0):
+        super().__init__(answers, tolerance)
+        self.budgets = [(answer, min(self.MAX_DISTANCE, len(answer) // 4)) for answer in self.accepted]
+
+    def matches(self, value):
+        value = self.normalize(value)
+        if not value:
+            return False
+        if value in self.accepted:
+            return True
+        return any(budget and within_distance(value, answer, budget) for answer, budget in self.budgets)
+
+
+@register(NUMERIC)
+class NumericMatcher(NormalizedMatcher):
+    """accepts any number within 'tolerance' of a numeric answer, answers
+    that are not numbers are compared like the normalized mode"""
+
+    def __init__(self, answers, tolerance=0.0):
+        answers = list(answers)
+        super().__init__(answers, tolerance)
+        self.numbers = [number for number in map(self.parse, answers) if number is not None]
+
+    @staticmethod
+    def parse(value):
+        try:
+            return float(value.strip().replace(',', ''))
+        except ValueError:
+            return None
+
+    def matches(self, value):
+        number = self.parse(value)
+        if number is not None and any(abs(number - target) <= self.tolerance for target in self.numbers):
+            return True
+        return super().matches(value)
+
+
+def answer_key(mode: str, answers: List[str], tolerance: float = 0.0) -> str:
+    """answer_key packs everything needed to grade a question into one string,
+    it is what ActiveTriviaQuiz stores for the question being played"""
+    return json.dumps({'mode': mode, 'answers': answers, 'tolerance': tolerance}, sort_keys=True)
+
+
+@lru_cache(maxsize=1024)
+def compile_answer_key(key: str) -> Matcher:
+    spec = json.loads(key)
+    return MATCHERS[spec['mode']](spec['answers'], spec['tolerance'])
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_builder', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triviaquestion',
+            name='alternate_answers',
+            field=models.TextField(blank=True, default='', help_text='other accepted answers, one per line'),
+        ),
+        migrations.AddField(
+            model_name='triviaquestion',
+            name='match_mode',
+            field=models.CharField(choices=[('exact', 'Exact (ignoring case)'), ('normalized', 'Ignore punctuation and spacing'), ('accent', 'Ignore punctuation, spacing and accents'), ('fuzzy', 'Allow small typos'), ('numeric', 'Number within tolerance')], default='exact', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='triviaquestion',
+            name='numeric_tolerance',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
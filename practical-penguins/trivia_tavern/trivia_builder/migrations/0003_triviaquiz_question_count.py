@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 17:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def count_questions(apps, schema_editor):
+    TriviaQuiz = apps.get_model('trivia_builder', 'TriviaQuiz')
+    TriviaQuestion = apps.get_model('trivia_builder', 'TriviaQuestion')
+    counts = (TriviaQuestion.objects.filter(quiz=OuterRef('pk')).order_by().values('quiz')
+              .annotate(count=Count('pk')).values('count'))
+    TriviaQuiz.objects.filter(triviaquestion__isnull=False).update(question_count=Subquery(counts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_builder', '0002_question_match_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triviaquiz',
+            name='question_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_builder', '0003_triviaquiz_question_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='triviaquiz',
+            index=models.Index(fields=['date_posted', 'id'], name='trivia_buil_date_po_775748_idx'),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
 
+from trivia_builder import catalog, matching
+
 
 class TriviaQuiz(models.Model):
 
@@ -9,10 +11,29 @@ class TriviaQuiz(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     description = models.CharField(max_length=500,)
     date_posted = models.DateTimeField(auto_now_add=True)
+    # kept up to date by trivia_builder.signals so listing pages never count questions per row
+    question_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # the catalog pages newest first with (date_posted, id) as the cursor
+            models.Index(fields=['date_posted', 'id']),
+        ]
 
     def __str__(self):
         return self.name
 
+    def recount_questions(self):
+        """recomputes question_count, needed after bulk_create or queryset update() which send no signals,
+        deletes send post_delete for every row and are counted by trivia_builder.signals"""
+        self.question_count = self.triviaquestion_set.count()
+        TriviaQuiz.objects.filter(pk=self.pk).update(question_count=self.question_count)
+        catalog.touch(self.pk)
+
+    def is_being_played(self):
+        """if a session is on one of the questions, its questions must not be renumbered or deleted then"""
+        return self.activetriviaquiz_set.filter(current_question_index__gt=0).exists()
+
     def get_absolute_url(self):
         return reverse('quiz-detail', kwargs={'pk': self.pk})
 
@@ -22,3 +43,13 @@ class TriviaQuestion(models.Model):
     question_answer = models.CharField(max_length=300, blank=False,)
     question_index = models.PositiveIntegerField(blank=False)
     quiz = models.ForeignKey(TriviaQuiz, on_delete=models.CASCADE)
+    match_mode = models.CharField(max_length=10, choices=matching.MATCH_MODE_CHOICES, default=matching.EXACT)
+    alternate_answers = models.TextField(blank=True, default='', help_text='other accepted answers, one per line')
+    numeric_tolerance = models.FloatField(default=0.0)
+
+    def answer_key(self):
+        answers = [self.question_answer] + self.alternate_answers.splitlines()
+        return matching.answer_key(self.match_mode, answers, self.numeric_tolerance)
+
+    def matcher(self):
+        return matching.compile_answer_key(self.answer_key())
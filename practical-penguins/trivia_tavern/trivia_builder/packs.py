@@ -0,0 +1,224 @@
+"""Bulk import and export of trivia packs
+
+A pack file holds one question per line, as JSON Lines or as CSV with the
+PACK_FIELDS columns. 'pack' names the trivia pack the question belongs to
+and the questions of a pack are numbered in file order, the lines of a pack
+do not have to be next to each other.
+
+Files are read and written a line at a time so their size does not matter.
+Imports are written in transactions of IMPORT_BATCH_SIZE questions with one
+bulk_create and one bulk_update each. Importing a pack the author already
+has brings it in line with the file: questions that changed are updated in
+place, which keeps the answers given to them, unchanged ones are not written
+at all and questions past the end of the file are deleted, so a question
+bank can be synced nightly by importing it again.
+"""
+import csv
+import functools
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from trivia_builder.forms import TriviaQuestionForm
+from trivia_builder.models import TriviaQuestion, TriviaQuiz
+
+PACK_FIELDS = ['pack', 'description', 'question_text', 'question_answer', 'match_mode', 'alternate_answers',
+               'numeric_tolerance']
+QUESTION_FIELDS = TriviaQuestionForm.Meta.fields
+# spreadsheet tools start their csv files with a byte order mark, it is skipped when there is one
+PACK_ENCODING = 'utf-8-sig'
+IMPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+
+
+class PackFileError(Exception):
+    """a line of a pack file that cannot be imported"""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def read_jsonl(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            raise PackFileError(number, 'not valid json')
+        if not isinstance(row, dict):
+            raise PackFileError(number, 'expected a json object')
+        yield number, row
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except csv.Error as e:
+        raise PackFileError(reader.line_num, str(e))
+
+
+def write_jsonl(rows):
+    for row in rows:
+        yield json.dumps(dict(row, alternate_answers=row['alternate_answers'].splitlines())) + '\n'
+
+
+class _Line:
+    """a file that hands back what is written to it, lets csv.writer produce one line at a time"""
+
+    def write(self, value):
+        return value
+
+
+def write_csv(rows):
+    writer = csv.DictWriter(_Line(), PACK_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+# format: (reader, writer, content type)
+FORMATS = {
+    'jsonl': (read_jsonl, write_jsonl, 'application/jsonl'),
+    'csv': (read_csv, write_csv, 'text/csv'),
+}
+
+
+def format_for(filename, default='jsonl'):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else default
+
+
+@functools.lru_cache(maxsize=None)
+def question_fields():
+    """the fields of the question editor, shared by every row instead of building a form per row"""
+    return TriviaQuestionForm().fields
+
+
+def export_rows(quizzes):
+    """the questions of 'quizzes' as pack file rows, read from the database in chunks"""
+    questions = (TriviaQuestion.objects.filter(quiz__in=quizzes)
+                 .order_by('quiz_id', 'question_index', 'pk')
+                 .values_list('quiz__name', 'quiz__description', *QUESTION_FIELDS))
+    for values in questions.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield dict(zip(PACK_FIELDS, values))
+
+
+class PackImporter:
+    """PackImporter writes the rows of pack files into the packs of 'author'
+    @run: import (line number, row) pairs as returned by a FORMATS reader
+    @packs: the packs imported so far by name
+    @questions: how many questions were imported
+
+    Only the current batch is held in memory, each batch is compared with
+    just the questions it overwrites
+    """
+
+    def __init__(self, author, batch_size=IMPORT_BATCH_SIZE):
+        self.author = author
+        self.batch_size = batch_size
+        self.packs = {}
+        self.questions = 0
+        # per pack: the number of questions imported so far
+        self._imported = {}
+
+    def run(self, rows):
+        batch = []
+        complete = False
+        try:
+            for line, row in rows:
+                batch.append(self.parse(line, row))
+                if len(batch) >= self.batch_size:
+                    self.write(batch)
+                    batch = []
+            self.write(batch)
+            complete = True
+        finally:
+            self.finish(complete)
+        return self
+
+    @staticmethod
+    def parse(line, row):
+        """validates one row like the question editor would, returns (line, pack, description, question)"""
+        pack = (row.get('pack') or '').strip()
+        if not pack:
+            raise PackFileError(line, 'the pack name is missing')
+        if len(pack) > TriviaQuiz._meta.get_field('name').max_length:
+            raise PackFileError(line, f'the pack name "{pack}" is too long')
+        alternates = row.get('alternate_answers') or ''
+        if not isinstance(alternates, list):
+            # one per line, a quoted csv cell keeps the line endings of the file
+            alternates = alternates.splitlines()
+        alternates = '\n'.join(alternates)
+        data = {
+            'question_text': row.get('question_text'),
+            'question_answer': row.get('question_answer'),
+            'match_mode': row.get('match_mode') or TriviaQuestion._meta.get_field('match_mode').default,
+            'alternate_answers': alternates,
+            'numeric_tolerance': row.get('numeric_tolerance') or 0,
+        }
+        values, errors = {}, []
+        for name, field in question_fields().items():
+            try:
+                values[name] = field.clean(data[name])
+            except ValidationError as e:
+                errors.append(f'{name}: {" ".join(e.messages)}')
+        if errors:
+            raise PackFileError(line, '; '.join(errors))
+        return line, pack, (row.get('description') or '').strip(), TriviaQuestion(**values)
+
+    def pack(self, line, name, description):
+        quiz = self.packs.get(name)
+        if quiz is None:
+            quiz = TriviaQuiz.objects.filter(author=self.author, name=name).order_by('pk').first()
+            if quiz is None:
+                quiz = TriviaQuiz.objects.create(author=self.author, name=name, description=description or name)
+            elif quiz.is_being_played():
+                raise PackFileError(line, f'the pack "{name}" is being played right now')
+            elif description and description != quiz.description:
+                quiz.description = description
+                quiz.save(update_fields=['description'])
+            self.packs[name] = quiz
+            self._imported[name] = 0
+        return quiz
+
+    def write(self, batch):
+        if not batch:
+            return
+        created, updated = [], []
+        with transaction.atomic():
+            by_pack = {}
+            for line, name, description, question in batch:
+                question.quiz = self.pack(line, name, description)
+                self._imported[name] += 1
+                question.question_index = self._imported[name]
+                by_pack.setdefault(name, []).append(question)
+            for questions in by_pack.values():
+                # the batch numbers the questions of a pack consecutively, one range covers them
+                existing = {values[0]: values[1:] for values in TriviaQuestion.objects.filter(
+                    quiz=questions[0].quiz,
+                    question_index__range=(questions[0].question_index, questions[-1].question_index),
+                ).values_list('question_index', 'pk', *QUESTION_FIELDS)}
+                for question in questions:
+                    current = existing.get(question.question_index)
+                    if current is None:
+                        created.append(question)
+                    elif current[1:] != tuple(getattr(question, field) for field in QUESTION_FIELDS):
+                        question.pk = current[0]
+                        updated.append(question)
+            if updated:
+                TriviaQuestion.objects.bulk_update(updated, QUESTION_FIELDS)
+            TriviaQuestion.objects.bulk_create(created)
+        self.questions += len(batch)
+
+    def finish(self, complete):
+        with transaction.atomic():
+            for name, quiz in self.packs.items():
+                if complete:
+                    # the file is the whole pack, questions it no longer has go
+                    TriviaQuestion.objects.filter(quiz=quiz, question_index__gt=self._imported[name]).delete()
+                quiz.recount_questions()
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from users.models import Profile
+from . import catalog
+from .models import TriviaQuestion, TriviaQuiz
+
+# what the catalog pages show of an author
+AUTHOR_FIELDS = {User: 'username', Profile: 'image'}
+
+
+@receiver(post_save, sender=TriviaQuestion)
+def count_new_question(sender, instance, created, **kwargs):
+    if created:
+        TriviaQuiz.objects.filter(pk=instance.quiz_id).update(question_count=F('question_count') + 1)
+
+
+@receiver(post_delete, sender=TriviaQuestion)
+def count_deleted_question(sender, instance, **kwargs):
+    TriviaQuiz.objects.filter(pk=instance.quiz_id, question_count__gt=0).update(
+        question_count=F('question_count') - 1)
+
+
+@receiver(post_save, sender=TriviaQuestion)
+@receiver(post_delete, sender=TriviaQuestion)
+def question_changed(sender, instance, **kwargs):
+    catalog.touch(instance.quiz_id)
+
+
+@receiver(post_save, sender=TriviaQuiz)
+@receiver(post_delete, sender=TriviaQuiz)
+def quiz_changed(sender, instance, **kwargs):
+    catalog.touch(instance.pk)
+
+
+def author_card(instance):
+    # read from __dict__ so a deferred field is not loaded just for this
+    value = instance.__dict__.get(AUTHOR_FIELDS[type(instance)])
+    return getattr(value, 'name', value)
+
+
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=Profile)
+def remember_author_card(sender, instance, **kwargs):
+    instance._catalog_card = author_card(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Profile)
+def author_changed(sender, instance, created, **kwargs):
+    """a renamed author or a new avatar changes the pages of all their quizzes,
+    other saves like the last_login update of every login leave the cache alone"""
+    card = author_card(instance)
+    if created or card == instance._catalog_card:
+        return
+    instance._catalog_card = card
+    author = instance.pk if sender is User else instance.user_id
+    catalog.touch(*TriviaQuiz.objects.filter(author_id=author).values_list('pk', flat=True))
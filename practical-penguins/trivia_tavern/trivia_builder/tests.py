@@ -0,0 +1,429 @@
+import itertools
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from trivia_builder import matching
+from trivia_builder.management.commands.bench_quiz_authoring import formset_data, question_data
+from trivia_builder.models import TriviaQuiz, TriviaQuestion
+from trivia_runner.models import ActiveTriviaQuiz
+from users.models import Profile
+
+
+class MatchingTest(SimpleTestCase):
+
+    def matcher(self, mode, *answers, tolerance=0.0):
+        return matching.compile_answer_key(matching.answer_key(mode, list(answers), tolerance))
+
+    def test_exact_ignores_case_only(self):
+        matcher = self.matcher(matching.EXACT, 'Tim Berners-Lee')
+        self.assertTrue(matcher.matches('tim berners-lee '))
+        self.assertFalse(matcher.matches('Tim Berners Lee'))
+
+    def test_normalized_and_accent_folded(self):
+        self.assertTrue(self.matcher(matching.NORMALIZED, 'Tim Berners-Lee').matches('tim  berners lee!'))
+        self.assertFalse(self.matcher(matching.NORMALIZED, 'Pokémon').matches('pokemon'))
+        self.assertTrue(self.matcher(matching.ACCENT_FOLDED, 'Pokémon').matches('POKEMON'))
+
+    def test_answers_without_letters_never_match(self):
+        for mode in (matching.NORMALIZED, matching.ACCENT_FOLDED, matching.FUZZY, matching.NUMERIC):
+            matcher = self.matcher(mode, 'Tim', '?!')
+            for answer in ('?!', '...', '   ', ''):
+                self.assertFalse(matcher.matches(answer), (mode, answer))
+            self.assertTrue(matcher.matches('tim!'), mode)
+
+    def test_alternate_answers(self):
+        matcher = self.matcher(matching.NORMALIZED, 'World Wide Web', 'WWW', 'the web')
+        self.assertTrue(matcher.matches('www'))
+        self.assertTrue(matcher.matches('The Web.'))
+        self.assertFalse(matcher.matches('internet'))
+
+    def test_fuzzy_allows_bounded_typos(self):
+        matcher = self.matcher(matching.FUZZY, 'Mosaic Netscape')
+        self.assertTrue(matcher.matches('mosiac netscape'))
+        self.assertTrue(matcher.matches('mosaic netscap'))
+        self.assertFalse(matcher.matches('mosaic'))
+        self.assertFalse(self.matcher(matching.FUZZY, 'BBS').matches('BBC'))
+
+    def test_numeric_tolerance(self):
+        matcher = self.matcher(matching.NUMERIC, '1969', tolerance=1)
+        self.assertTrue(matcher.matches('1,970'))
+        self.assertTrue(matcher.matches('1968.5'))
+        self.assertFalse(matcher.matches('1971'))
+        self.assertFalse(matcher.matches('sixty nine'))
+
+    def test_within_distance_agrees_with_full_levenshtein(self):
+        def levenshtein(a, b):
+            previous = list(range(len(b) + 1))
+            for i, char_a in enumerate(a, start=1):
+                current = [i]
+                for j, char_b in enumerate(b, start=1):
+                    current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+                previous = current
+            return previous[-1]
+
+        words = ['', 'a', 'ab', 'ba', 'abc', 'acb', 'abcd', 'xbcd', 'abdc', 'bcda']
+        for a, b in itertools.product(words, repeat=2):
+            for k in range(3):
+                self.assertEqual(matching.within_distance(a, b, k), levenshtein(a, b) <= k, (a, b, k))
+
+
+class QuizCatalogTest(TestCase):
+
+    def setUp(self):
+        self.host = User.objects.create_user(username='host', password='pw')
+        self.client.force_login(self.host)
+
+    def make_quizzes(self, count):
+        for _ in range(count):
+            quiz = TriviaQuiz.objects.create(name='Pub night', author=self.host, description='test quiz')
+            for i in (1, 2):
+                TriviaQuestion.objects.create(quiz=quiz, question_index=i, question_text='?', question_answer='!')
+            ActiveTriviaQuiz.objects.create(trivia_quiz=quiz, session_master=self.host)
+
+    def page_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Number of questions: 2')
+        return len(queries)
+
+    def test_question_count_follows_questions(self):
+        self.make_quizzes(1)
+        quiz = TriviaQuiz.objects.get()
+        self.assertEqual(quiz.question_count, 2)
+
+        quiz.triviaquestion_set.first().delete()
+        quiz.refresh_from_db()
+        self.assertEqual(quiz.question_count, 1)
+
+        TriviaQuestion.objects.bulk_create([TriviaQuestion(quiz=quiz, question_index=i, question_text='?',
+                                                           question_answer='!') for i in (2, 3)])
+        quiz.recount_questions()
+        self.assertEqual(TriviaQuiz.objects.get().question_count, 3)
+
+    def test_listing_queries_do_not_grow_with_the_page(self):
+        urls = [reverse('quiz-list'), reverse('activequiz-list'), reverse('profile')]
+        self.make_quizzes(1)
+        one_quiz = [self.page_queries(url) for url in urls]
+        self.make_quizzes(9)
+        self.assertEqual([self.page_queries(url) for url in urls], one_quiz)
+
+
+class CatalogCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.host = User.objects.create_user(username='host', password='pw')
+        self.quiz = TriviaQuiz.objects.create(name='Pub night', author=self.host, description='test quiz')
+        TriviaQuestion.objects.create(quiz=self.quiz, question_index=1, question_text='Who?', question_answer='Tim')
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (reverse('quiz-list'), reverse('quiz-detail', kwargs={'pk': self.quiz.pk})):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            TriviaQuestion.objects.create(quiz=self.quiz, question_index=2, question_text='What?',
+                                          question_answer='WWW')
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            TriviaQuestion.objects.filter(question_index=2).get().delete()
+
+    def test_etag_varies_by_user(self):
+        url = reverse('quiz-detail', kwargs={'pk': self.quiz.pk})
+        anonymous = self.client.get(url)['ETag']
+        self.client.force_login(self.host)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Edit Quiz')
+
+    def test_author_changes_reach_the_catalog(self):
+        url = reverse('quiz-detail', kwargs={'pk': self.quiz.pk})
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.host)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.host.username = 'renamed'
+        self.host.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'renamed')
+        self.assertContains(self.client.get(reverse('quiz-list')), 'renamed')
+
+        etag = response['ETag']
+        profile = Profile.objects.get(user=self.host)
+        profile.image = 'profile_pics/new.png'
+        profile.save()
+        self.assertContains(self.client.get(reverse('quiz-list')), 'profile_pics/new.png')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_fragments_are_rendered_once_per_version(self):
+        url = reverse('quiz-detail', kwargs={'pk': self.quiz.pk})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(url), 'Who?')
+        self.assertFalse([query for query in queries if 'triviaquestion' in query['sql']])
+
+        question = self.quiz.triviaquestion_set.get()
+        question.question_text = 'Who invented the web?'
+        question.save()
+        self.assertContains(self.client.get(url), 'Who invented the web?')
+        self.assertContains(self.client.get(reverse('quiz-list')), 'Number of questions: 1')
+
+        TriviaQuiz.objects.filter(pk=self.quiz.pk).update(name='Quiet change')
+        self.assertNotContains(self.client.get(url), 'Quiet change')
+        self.quiz.recount_questions()
+        self.assertContains(self.client.get(url), 'Quiet change')
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        host = User.objects.create_user(username='host', password='pw')
+        TriviaQuiz.objects.bulk_create([TriviaQuiz(name=f'quiz {i}', author=host, description='test quiz')
+                                        for i in range(25)])
+        # half of the catalog shares one timestamp so the pk has to break the ties
+        TriviaQuiz.objects.filter(pk__in=TriviaQuiz.objects.order_by('pk').values('pk')[5:18]).update(
+            date_posted=TriviaQuiz.objects.order_by('pk').first().date_posted)
+        self.newest_first = list(TriviaQuiz.objects.order_by('-date_posted', '-pk').values_list('pk', flat=True))
+
+    def walk(self, direction, cursor=None):
+        pages = []
+        while True:
+            response = self.client.get(reverse('quiz-list'), {direction: cursor} if cursor else {})
+            page = response.context['page_obj']
+            pages.append([quiz.pk for quiz in page])
+            cursor = page.next_cursor if direction == 'after' else page.previous_cursor
+            if cursor is None:
+                return pages, page
+
+    def test_pages_cover_the_catalog_in_order(self):
+        pages, last = self.walk('after')
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), self.newest_first)
+
+        back, first = self.walk('before', last.previous_cursor)
+        self.assertEqual(back, pages[-2::-1])
+        self.assertFalse(first.has_previous())
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        first = self.client.get(reverse('quiz-list'))
+        cursor = first.context['page_obj'].next_cursor
+        cache.clear()
+        with CaptureQueriesContext(connection) as page_one:
+            self.client.get(reverse('quiz-list'))
+        with CaptureQueriesContext(connection) as page_two:
+            self.client.get(reverse('quiz-list'), {'after': cursor})
+        # the total is counted once for the whole listing and cached, every page is one range scan
+        rows = [query['sql'] for query in page_one if 'COUNT' not in query['sql']]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(len(page_two), 1)
+        self.assertNotIn('OFFSET', page_two[0]['sql'])
+
+    def test_bad_cursor_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('quiz-list'), {'after': 'nonsense'}).status_code, 404)
+
+
+class QuizAuthoringTest(TestCase):
+
+    def setUp(self):
+        self.host = User.objects.create_user(username='host', password='pw')
+        self.client.force_login(self.host)
+
+    def create_quiz(self, count):
+        data = formset_data([question_data('form', i) for i in range(count)])
+        data.update({'name': 'Pub night', 'description': 'test quiz'})
+        self.assertRedirects(self.client.post(reverse('quiz-create'), data), reverse('quiz-list'))
+        return TriviaQuiz.objects.get(author=self.host)
+
+    def test_create_numbers_questions_in_form_order(self):
+        quiz = self.create_quiz(3)
+        self.assertEqual(quiz.question_count, 3)
+        self.assertEqual(list(quiz.triviaquestion_set.order_by('question_index').values_list(
+            'question_index', 'question_text')), [(1, 'Question 0?'), (2, 'Question 1?'), (3, 'Question 2?')])
+
+    def test_update_edits_deletes_and_adds(self):
+        quiz = self.create_quiz(3)
+        self.assertContains(self.client.get(reverse('quiz-update', kwargs={'pk': quiz.pk})), 'Save Quiz')
+        first, second, third = quiz.triviaquestion_set.order_by('question_index').values_list('pk', flat=True)
+        edits = [question_data('form', 0, first), question_data('form', 1, second),
+                 question_data('form', 2, third), question_data('form', 3)]
+        edits[0]['form-0-DELETE'] = 'on'
+        edits[1]['form-1-question_text'] = 'Who invented the web?'
+        data = formset_data(edits, initial=3)
+        data.update({'name': 'Pub night', 'description': 'edited'})
+
+        response = self.client.post(reverse('quiz-update', kwargs={'pk': quiz.pk}), data)
+
+        self.assertRedirects(response, quiz.get_absolute_url())
+        quiz.refresh_from_db()
+        self.assertEqual(quiz.description, 'edited')
+        self.assertEqual(quiz.question_count, 3)
+        self.assertEqual(list(quiz.triviaquestion_set.order_by('question_index').values_list('pk', 'question_text')),
+                         [(second, 'Who invented the web?'), (third, 'Question 2?'),
+                          (third + 1, 'Question 3?')])
+
+    def test_update_refuses_questions_of_other_quizzes(self):
+        quiz = self.create_quiz(1)
+        other = TriviaQuiz.objects.create(name='Other', author=self.host, description='other quiz')
+        foreign = TriviaQuestion.objects.create(quiz=other, question_index=1, question_text='?', question_answer='!')
+        data = formset_data([question_data('form', 0, foreign.pk)], initial=1)
+        data.update({'name': 'Pub night', 'description': 'edited'})
+
+        response = self.client.post(reverse('quiz-update', kwargs={'pk': quiz.pk}), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TriviaQuestion.objects.get(pk=foreign.pk).quiz, other)
+
+    def test_update_is_refused_while_the_pack_is_played(self):
+        quiz = self.create_quiz(2)
+        first, second = quiz.triviaquestion_set.order_by('question_index').values_list('pk', flat=True)
+        session = ActiveTriviaQuiz(trivia_quiz=quiz, session_master=self.host)
+        session.set_question_index(1)
+        session.save()
+        edits = [question_data('form', 0, first), question_data('form', 1, second)]
+        edits[0]['form-0-DELETE'] = 'on'
+        data = formset_data(edits, initial=2)
+        data.update({'name': 'Pub night', 'description': 'edited'})
+
+        response = self.client.post(reverse('quiz-update', kwargs={'pk': quiz.pk}), data)
+
+        self.assertContains(response, 'being played right now')
+        session.refresh_from_db()
+        self.assertEqual(session.current_question_id, first)
+        self.assertEqual(quiz.triviaquestion_set.count(), 2)
+
+        session.set_question_index(-1)
+        session.save()
+        response = self.client.post(reverse('quiz-update', kwargs={'pk': quiz.pk}), data)
+        self.assertRedirects(response, quiz.get_absolute_url())
+        self.assertEqual(list(quiz.triviaquestion_set.values_list('pk', flat=True)), [second])
+        # deleting without adding is counted by the signals alone
+        self.assertEqual(TriviaQuiz.objects.get(pk=quiz.pk).question_count, 1)
+
+    def test_benchmark_saves_big_packs_in_few_queries(self):
+        out = StringIO()
+        call_command('bench_quiz_authoring', questions=60, max_queries=30, stdout=out)
+        self.assertIn('create: 60 questions', out.getvalue())
+        self.assertIn('update: 60 questions', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='bench_quiz_authoring_').exists())
+
+
+class PackImportExportTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='bank', password='pw')
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def pack_file(self, name, rows):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'w', encoding='utf-8') as out:
+            out.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def questions(self, pack):
+        return list(TriviaQuestion.objects.filter(quiz__name=pack).order_by('question_index')
+                    .values_list('question_index', 'question_text', 'alternate_answers'))
+
+    def test_import_interleaved_packs_in_batches(self):
+        path = self.pack_file('bank.jsonl', [
+            {'pack': 'Web', 'description': 'the web', 'question_text': 'Who?', 'question_answer': 'Tim',
+             'alternate_answers': ['TimBL', 'Sir Tim']},
+            {'pack': 'BBS', 'question_text': 'Baud?', 'question_answer': '300', 'match_mode': 'numeric'},
+            {'pack': 'Web', 'question_text': 'When?', 'question_answer': '1989'},
+        ])
+        out = StringIO()
+        call_command('import_packs', path, author='bank', batch_size=2, stdout=out)
+
+        self.assertIn('imported 3 questions into 2 packs', out.getvalue())
+        self.assertEqual(self.questions('Web'), [(1, 'Who?', 'TimBL\nSir Tim'), (2, 'When?', '')])
+        self.assertEqual(TriviaQuiz.objects.get(name='Web').question_count, 2)
+        self.assertEqual(TriviaQuiz.objects.get(name='BBS').description, 'BBS')
+
+    def test_reimport_syncs_packs_in_place(self):
+        rows = [{'pack': 'Web', 'question_text': f'Question {i}?', 'question_answer': f'{i}'} for i in range(4)]
+        call_command('import_packs', self.pack_file('bank.jsonl', rows), author='bank', stdout=StringIO())
+        pks = list(TriviaQuestion.objects.order_by('question_index').values_list('pk', flat=True))
+
+        rows[1]['question_text'] = 'Edited?'
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_packs', self.pack_file('bank.jsonl', rows[:3]), author='bank', batch_size=2,
+                         stdout=StringIO())
+
+        self.assertEqual(TriviaQuiz.objects.get().question_count, 3)
+        self.assertEqual(list(TriviaQuestion.objects.order_by('question_index').values_list('pk', 'question_text')),
+                         [(pks[0], 'Question 0?'), (pks[1], 'Edited?'), (pks[2], 'Question 2?')])
+        # every batch only reads back the questions it overwrites
+        reads = [query['sql'] for query in queries if 'question_index" BETWEEN' in query['sql']]
+        self.assertEqual(len(reads), 2)
+        self.assertIn('BETWEEN 1 AND 2', reads[0])
+        self.assertIn('BETWEEN 3 AND 3', reads[1])
+
+    def test_csv_from_a_spreadsheet(self):
+        path = os.path.join(self.folder.name, 'bank.csv')
+        with open(path, 'w', encoding='utf-8-sig', newline='') as out:
+            out.write('pack,question_text,question_answer\r\nWeb,Who?,Tim\r\n')
+        call_command('import_packs', path, author='bank', stdout=StringIO())
+        self.assertEqual(self.questions('Web'), [(1, 'Who?', '')])
+
+        self.client.force_login(self.author)
+        upload = SimpleUploadedFile('bank.csv', '\ufeffpack,question_text,question_answer\r\nWeb,When?,1989\r\n'
+                                    .encode())
+        self.assertRedirects(self.client.post(reverse('quiz-import'), {'pack_file': upload}), reverse('quiz-list'))
+        self.assertEqual(self.questions('Web'), [(1, 'When?', '')])
+
+    def test_packs_being_played_are_not_synced(self):
+        rows = [{'pack': 'Web', 'question_text': 'Who?', 'question_answer': 'Tim'}]
+        call_command('import_packs', self.pack_file('bank.jsonl', rows), author='bank', stdout=StringIO())
+        session = ActiveTriviaQuiz(trivia_quiz=TriviaQuiz.objects.get(), session_master=self.author)
+        session.set_question_index(1)
+        session.save()
+
+        with self.assertRaisesMessage(CommandError, 'line 1: the pack "Web" is being played'):
+            call_command('import_packs', self.pack_file('bank.jsonl', [dict(rows[0], question_text='?')]),
+                         author='bank', stdout=StringIO())
+        self.assertEqual(self.questions('Web'), [(1, 'Who?', '')])
+
+    def test_bad_line_is_reported(self):
+        path = self.pack_file('bank.jsonl', [
+            {'pack': 'Web', 'question_text': 'Who?', 'question_answer': 'Tim'},
+            {'pack': 'Web', 'question_text': 'When?', 'question_answer': '1989', 'match_mode': 'psychic'},
+        ])
+        with self.assertRaisesMessage(CommandError, 'line 2: match_mode'):
+            call_command('import_packs', path, author='bank', stdout=StringIO())
+
+    def test_upload_and_streaming_export(self):
+        other = User.objects.create_user(username='other', password='pw')
+        TriviaQuiz.objects.create(name='Not mine', author=other, description='other quiz')
+        self.client.force_login(self.author)
+        upload = SimpleUploadedFile('bank.csv', b'pack,question_text,question_answer,alternate_answers\r\n'
+                                                b'Web,Who?,Tim,"TimBL\r\nSir Tim"\r\nWeb,When?,1989,\r\n')
+
+        response = self.client.post(reverse('quiz-import'), {'pack_file': upload})
+
+        self.assertRedirects(response, reverse('quiz-list'))
+        self.assertEqual(self.questions('Web'), [(1, 'Who?', 'TimBL\nSir Tim'), (2, 'When?', '')])
+
+        response = self.client.get(reverse('quiz-export', kwargs={'fmt': 'jsonl'}))
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['pack'], row['question_text'], row['alternate_answers']) for row in rows],
+                         [('Web', 'Who?', ['TimBL', 'Sir Tim']), ('Web', 'When?', [])])
+
+        response = self.client.get(reverse('quiz-export', kwargs={'fmt': 'csv'}))
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines()[0],
+                         'pack,description,question_text,question_answer,match_mode,alternate_answers,'
+                         'numeric_tolerance')
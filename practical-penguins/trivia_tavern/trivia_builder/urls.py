@@ -4,12 +4,16 @@ from trivia_builder.views import (TriviaQuizDeleteView,
                                   TriviaQuizUpdateView,
                                   TriviaQuizCreateView,
                                   TriviaQuizDetailView,
-                                  TriviaQuizListView)
+                                  TriviaQuizListView,
+                                  pack_export,
+                                  pack_import)
 
 urlpatterns = [
     path('id/<int:pk>/', TriviaQuizDetailView.as_view(), name='quiz-detail'),
     path('new/', TriviaQuizCreateView.as_view(), name='quiz-create'),
     path('<int:pk>/update/', TriviaQuizUpdateView.as_view(), name='quiz-update'),
     path('<int:pk>/delete/', TriviaQuizDeleteView.as_view(), name='quiz-delete'),
+    path('import/', pack_import, name='quiz-import'),
+    path('export/<str:fmt>/', pack_export, name='quiz-export'),
     path('', TriviaQuizListView.as_view(), name='quiz-list'),
 ]
@@ -1,11 +1,17 @@
+import codecs
+
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
-from django.db import transaction, IntegrityError
+from django.db import transaction
 from django.forms import modelformset_factory
-from django.http import HttpResponseRedirect
-from django.shortcuts import get_object_or_404, redirect, render
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic import (
     ListView,
     DetailView,
@@ -14,18 +20,38 @@ from django.views.generic import (
     DeleteView
 )
 
-from trivia_builder.forms import TriviaQuizForm, TriviaQuestionForm
+from trivia_builder import catalog
+from trivia_builder.forms import BaseTriviaQuestionFormSet, PackUploadForm, TriviaQuizForm, TriviaQuestionForm
 from trivia_builder.models import TriviaQuiz, TriviaQuestion
+from trivia_builder.packs import FORMATS, PACK_ENCODING, PackFileError, PackImporter, export_rows, format_for
 from trivia_runner.models import ActiveTriviaQuiz
+from trivia_tavern.pagination import KeysetPaginationMixin
+
+
+# catalog pages are served from cached fragments and answer polling screens with 304 until a quiz changes
+catalog_page = [cache_control(private=True, no_cache=True),
+                condition(etag_func=catalog.etag, last_modified_func=catalog.last_modified)]
 
 
-class TriviaQuizListView(ListView):
+@method_decorator(catalog_page, name='get')
+class TriviaQuizListView(KeysetPaginationMixin, ListView):
     model = TriviaQuiz
+    queryset = TriviaQuiz.objects.select_related('author__profile')
     template_name = 'trivia_builder/quiz_list.html'
     context_object_name = 'quizzes'
-    ordering = ['-date_posted']
+    keyset_field = 'date_posted'
     paginate_by = 10
 
+    def get_count_key(self):
+        # the catalog version changes with every new or deleted quiz, so the total is exact
+        return f'count:quizzes:{catalog.version()!r}'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['catalog_version'] = catalog.version()
+        context['catalog_timeout'] = catalog.CATALOG_TIMEOUT
+        return context
+
 
 class PassRequestToFormViewMixin:
     def get_form_kwargs(self):
@@ -45,11 +71,18 @@ class UserTriviaQuizListView(ListView):
         return TriviaQuiz.objects.filter(author=user).order_by('-date_posted')
 
 
+@method_decorator(catalog_page, name='get')
 class TriviaQuizDetailView(DetailView):
     model = TriviaQuiz
     context_object_name = 'quiz'
     template_name = 'trivia_builder/triviaquiz_detail.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['catalog_version'] = catalog.version(self.object.pk)
+        context['catalog_timeout'] = catalog.CATALOG_TIMEOUT
+        return context
+
     def post(self, request, *args, **kwargs):
         active_trivia_quiz = ActiveTriviaQuiz.objects.create(trivia_quiz=self.get_object(),
                                                              session_master=request.user)
@@ -57,54 +90,101 @@ class TriviaQuizDetailView(DetailView):
         return HttpResponseRedirect(reverse('activequiz', kwargs={'pk': active_trivia_quiz.pk}))
 
 
-class TriviaQuizCreateView(PassRequestToFormViewMixin, LoginRequiredMixin, CreateView):
+TriviaQuestionFormSet = modelformset_factory(TriviaQuestion, form=TriviaQuestionForm,
+                                             formset=BaseTriviaQuestionFormSet,
+                                             extra=0, min_num=1, validate_min=True, can_delete=True)
+
+
+def save_quiz(quiz_form, question_formset):
+    """saves a validated quiz form and its question formset in one transaction and returns the quiz
+
+    Questions are numbered in the order of the forms. New questions go in with
+    one bulk_create and edited or moved ones with one bulk_update, so a pack of
+    500 questions costs about as many queries as a pack of 5, only deleting
+    questions still costs a little per question
+    """
+    deleted_forms = question_formset.deleted_forms
+    deleted = [form.instance.pk for form in deleted_forms if form.instance.pk]
+    created, updated = [], []
+    with transaction.atomic():
+        quiz = quiz_form.save()
+        index = 0
+        for form in question_formset.forms:
+            question = form.instance
+            # extra forms the author left blank are skipped
+            if form in deleted_forms or (question.pk is None and not form.has_changed()):
+                continue
+            index += 1
+            if question.pk is None:
+                question.quiz = quiz
+                question.question_index = index
+                created.append(question)
+            elif form.has_changed() or question.question_index != index:
+                question.question_index = index
+                updated.append(question)
+        if deleted:
+            TriviaQuestion.objects.filter(quiz=quiz, pk__in=deleted).delete()
+        if updated:
+            TriviaQuestion.objects.bulk_update(updated, TriviaQuestionForm.Meta.fields + ['question_index'])
+        if created:
+            TriviaQuestion.objects.bulk_create(created)
+            # bulk_create sends no signals, deleted questions were already counted by trivia_builder.signals
+            quiz.recount_questions()
+    return quiz
+
+
+class QuizFormsMixin:
+    template_name = 'trivia_builder/triviaquiz_form.html'
+
+    def render_forms(self, quiz_form, question_formset):
+        return render(self.request, self.template_name, {'quiz_form': quiz_form, 'question_formset': question_formset})
+
+
+class TriviaQuizCreateView(PassRequestToFormViewMixin, LoginRequiredMixin, QuizFormsMixin, CreateView):
     model = TriviaQuiz
     fields = ['name']
-    template_name = 'trivia_builder/triviaquiz_form.html'
 
     def post(self, request, *args, **kwargs):
         quiz_form = TriviaQuizForm(request.POST)
-        TriviaQuestionFormSet = modelformset_factory(TriviaQuestion, form=TriviaQuestionForm)
-        question_formset = TriviaQuestionFormSet(request.POST)
-        new_questions = []
+        question_formset = TriviaQuestionFormSet(request.POST, queryset=TriviaQuestion.objects.none())
         if quiz_form.is_valid() and question_formset.is_valid():
             quiz_form.instance.author = self.request.user
-            quiz = quiz_form.save()
-            for i, question_form in enumerate(question_formset.forms, start=1):
-                question_form.instance.quiz = quiz
-                question_form.instance.question_index = i
-                question = question_form.save()
-                new_questions.append(question)
-            question_formset.save()
-
-            try:
-                with transaction.atomic():
-                    TriviaQuestion.objects.bulk_create(new_questions)
-                    quiz.save()
-
-                    # And notify our users that it worked
-                    messages.success(request, 'You have created your quiz.')
-                    return HttpResponseRedirect(reverse('quiz-list'))
-
-            except IntegrityError:  # If the transaction failed
-                messages.error(request, 'There was an error saving your profile.')
-                return redirect(reverse('quiz-list'))
-        return render(request, self.template_name, {'quiz_form': quiz_form, 'question_formset': question_formset})
+            save_quiz(quiz_form, question_formset)
+            # And notify our users that it worked
+            messages.success(request, 'You have created your quiz.')
+            return HttpResponseRedirect(reverse('quiz-list'))
+        return self.render_forms(quiz_form, question_formset)
 
     def get(self, request, *args, **kwargs):
-        quiz_form = TriviaQuizForm()
-        TriviaQuestionFormSet = modelformset_factory(TriviaQuestion, form=TriviaQuestionForm, extra=1)
-        question_formset = TriviaQuestionFormSet(queryset=TriviaQuestion.objects.none())
-        return render(request, self.template_name, {'quiz_form': quiz_form, 'question_formset': question_formset})
+        return self.render_forms(TriviaQuizForm(), TriviaQuestionFormSet(queryset=TriviaQuestion.objects.none()))
 
 
-class TriviaQuizUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class TriviaQuizUpdateView(LoginRequiredMixin, UserPassesTestMixin, QuizFormsMixin, UpdateView):
     model = TriviaQuiz
     fields = ['name']
 
-    def form_valid(self, form):
-        form.instance.author = self.request.user
-        return super().form_valid(form)
+    def questions(self):
+        return self.object.triviaquestion_set.order_by('question_index')
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        quiz_form = TriviaQuizForm(request.POST, instance=self.object)
+        question_formset = TriviaQuestionFormSet(request.POST, queryset=self.questions())
+        if quiz_form.is_valid() and question_formset.is_valid():
+            if self.object.is_being_played():
+                # a running session points at its current question, it must not move or disappear under it
+                quiz_form.add_error(None, 'This pack is being played right now, you can edit it once the session '
+                                          'has ended.')
+            else:
+                quiz = save_quiz(quiz_form, question_formset)
+                messages.success(request, 'You have updated your quiz.')
+                return HttpResponseRedirect(quiz.get_absolute_url())
+        return self.render_forms(quiz_form, question_formset)
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return self.render_forms(TriviaQuizForm(instance=self.object),
+                                 TriviaQuestionFormSet(queryset=self.questions()))
 
     def test_func(self):
         trivia_quiz = self.get_object()
@@ -122,3 +202,39 @@ class TriviaQuizDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         if self.request.user == trivia_quiz.author:
             return True
         return False
+
+
+@login_required
+def pack_import(request):
+    """imports an uploaded pack file into the packs of the user, see trivia_builder/packs.py"""
+    if request.method == 'POST':
+        form = PackUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['pack_file']
+            importer = PackImporter(request.user)
+            try:
+                # the upload is read a line at a time, big files stay on disk
+                importer.run(FORMATS[format_for(upload.name)][0](codecs.iterdecode(upload, PACK_ENCODING)))
+            except (PackFileError, UnicodeDecodeError) as e:
+                messages.error(request, f'{upload.name} {e}, {importer.questions} questions were imported before it.')
+            else:
+                messages.success(request, f'Imported {importer.questions} questions into {len(importer.packs)} packs.')
+                return HttpResponseRedirect(reverse('quiz-list'))
+    else:
+        form = PackUploadForm()
+    return render(request, 'trivia_builder/pack_import.html', {'form': form})
+
+
+@login_required
+def pack_export(request, fmt):
+    """streams the packs of the user as a pack file, staff users get every pack or those of ?author="""
+    if fmt not in FORMATS:
+        raise Http404('Unknown pack file format')
+    quizzes = TriviaQuiz.objects.filter(author=request.user)
+    if request.user.is_staff:
+        author = request.GET.get('author')
+        quizzes = TriviaQuiz.objects.filter(author__username=author) if author else TriviaQuiz.objects.all()
+    _, writer, content_type = FORMATS[fmt]
+    response = StreamingHttpResponse(writer(export_rows(quizzes)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="trivia_packs.{fmt}"'
+    return response
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import re
+
+from django.conf import settings
+
+from .live import feeds
+
+
+class HostEventsApp:
+    """HostEventsApp is an ASGI middleware streaming live snapshots of a
+    session to the host page as server-sent events at
+    /activequiz/<pk>/events/, every other request goes to 'app'
+
+    The stream only carries what the host screen shows anyway (team count,
+    answers received, the top of the leaderboard) so it is open to any viewer,
+    a projector does not need to log in
+    """
+    path = re.compile(r'^/activequiz/(?P<pk>\d+)/events/$')
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = self.path.match(scope.get('path', '')) if scope['type'] == 'http' else None
+        if match is None or scope['method'] != 'GET':
+            return await self.app(scope, receive, send)
+        await self.stream(int(match.group('pk')), receive, send)
+
+    @staticmethod
+    async def disconnected(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def stream(self, pk, receive, send):
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'),
+                        (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')],
+        })
+        queue = feeds.subscribe(pk)
+        disconnect = asyncio.ensure_future(self.disconnected(receive))
+        try:
+            while True:
+                snapshot = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({snapshot, disconnect}, timeout=settings.LIVE_FEED_HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    snapshot.cancel()
+                    return
+                if snapshot not in done:
+                    snapshot.cancel()
+                    # keeps proxies from closing an idle stream
+                    await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                    continue
+                if snapshot.result() is None:
+                    await send({'type': 'http.response.body', 'body': b'event: closed\ndata: {}\n\n'})
+                    return
+                event = f'event: update\ndata: {json.dumps(snapshot.result())}\n\n'
+                await send({'type': 'http.response.body', 'body': event.encode(), 'more_body': True})
+        finally:
+            feeds.unsubscribe(pk, queue)
+            disconnect.cancel()
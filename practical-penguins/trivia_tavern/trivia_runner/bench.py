@@ -0,0 +1,41 @@
+"""Test sessions for the bench_* commands
+
+The benchmarks run against the real database, so every session gets a host
+of its own and cleanup() deletes that host with everything it owns.
+"""
+import uuid
+
+from django.contrib.auth.models import User
+
+from trivia_builder.models import TriviaQuiz, TriviaQuestion
+from trivia_runner.models import ActiveTriviaQuiz, Player
+from twilio_messenger.models import ScoreTracker, OutboundMessage
+
+
+def make_session(name, num_questions=1, players=(), question_index=0):
+    """an active session of a new quiz with 'num_questions' questions (question i is answered
+    'Answer i') and a player and score row for every (phone number, team name) in 'players'"""
+    host = User.objects.create(username=f'{name}_{uuid.uuid4().hex[:12]}')
+    quiz = TriviaQuiz.objects.create(name='Load test', author=host, description=name)
+    TriviaQuestion.objects.bulk_create([
+        TriviaQuestion(quiz=quiz, question_index=i, question_text=f'Question {i}?', question_answer=f'Answer {i}')
+        for i in range(1, num_questions + 1)])
+    quiz.recount_questions()
+    active_quiz = ActiveTriviaQuiz(trivia_quiz=quiz, session_master=host)
+    active_quiz.set_question_index(question_index)
+    active_quiz.save()
+    players = Player.objects.bulk_create([
+        Player(active_quiz=active_quiz, team_name=team_name, phone_number=phone)
+        for phone, team_name in players])
+    ScoreTracker.objects.bulk_create([
+        ScoreTracker(player_phone=player.phone_number, team_name=player.team_name,
+                     session_code=active_quiz.session_code)
+        for player in players])
+    return active_quiz
+
+
+def cleanup(active_quiz, phones):
+    """removes the session, its host and quiz, and whatever the phones in 'phones' left behind"""
+    ScoreTracker.objects.filter(session_code=active_quiz.session_code).delete()
+    OutboundMessage.objects.filter(recipient__in=phones).delete()
+    active_quiz.trivia_quiz.author.delete()
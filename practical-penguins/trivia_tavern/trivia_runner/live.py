@@ -0,0 +1,150 @@
+"""Live updates for the host screen
+
+SMSBot calls publish() whenever a team joins or leaves, an answer comes in
+or a round opens or closes. The asgi app in trivia_runner.asgi streams a
+snapshot of the session to every open host page (server-sent events).
+
+Every watched session has one SessionFeed. A publish only flags the feed as
+changed, the feed then reads one snapshot, at most once per
+LIVE_FEED_COALESCE_SECONDS, and fans the same snapshot out to all of its
+viewers, so a projector and three host tabs cost the same as one. Changes
+made in another process are picked up by re-reading every
+LIVE_FEED_POLL_SECONDS.
+"""
+import asyncio
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from trivia_runner.models import ActiveTriviaQuiz
+from twilio_messenger.leaderboard import LiveLeaderboard
+from twilio_messenger.models import ScoreTracker
+
+logger = logging.getLogger(__name__)
+
+LIVE_LEADERBOARD_SIZE = 5
+
+
+def read_snapshot(pk):
+    """everything the host screen shows about session 'pk' in one query,
+    plus the leaderboard from the cache. None once the session is gone"""
+    try:
+        teams = (ScoreTracker.objects.filter(session_code=OuterRef('session_code'))
+                 .values('session_code'))
+        session = (ActiveTriviaQuiz.objects.filter(pk=pk)
+                   .annotate(joined=Coalesce(Subquery(teams.annotate(count=Count('pk')).values('count'),
+                                                      output_field=IntegerField()), 0),
+                             answered=Coalesce(Subquery(teams.annotate(count=Count('pk', filter=Q(
+                                 answered_this_round=True))).values('count'), output_field=IntegerField()), 0))
+                   .values('session_code', 'current_question_index', 'round_deadline', 'round_timed_out',
+                           'joined', 'answered')
+                   .first())
+        if session is None:
+            return None
+        return {
+            'question': session['current_question_index'],
+            'joined': session['joined'],
+            'answered': session['answered'],
+            'round_open': session['round_deadline'] is not None and not session['round_timed_out'],
+            'leaderboard': [list(row) for row in
+                            LiveLeaderboard(session['session_code']).top(LIVE_LEADERBOARD_SIZE)],
+        }
+    finally:
+        close_old_connections()
+
+
+class SessionFeed:
+
+    def __init__(self, pk, loop):
+        self.pk = pk
+        self.loop = loop
+        self.viewers = set()
+        self.changed = asyncio.Event()
+        self.changed.set()
+        self.last = None
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        if self.last is not None:
+            queue.put_nowait(self.last)
+        self.viewers.add(queue)
+        return queue
+
+    async def run(self, feeds):
+        try:
+            while self.viewers:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=settings.LIVE_FEED_POLL_SECONDS)
+                    # let a burst of answers settle so it costs one read
+                    await asyncio.sleep(settings.LIVE_FEED_COALESCE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                self.changed.clear()
+                if not self.viewers:
+                    break
+                try:
+                    snapshot = await self.loop.run_in_executor(None, read_snapshot, self.pk)
+                except Exception:
+                    # the viewers keep the last snapshot, the next change or poll reads again
+                    logger.exception('could not read the live snapshot of session %s', self.pk)
+                    continue
+                if snapshot != self.last or snapshot is None:
+                    self.last = snapshot
+                    for queue in self.viewers:
+                        queue.put_nowait(snapshot)
+        finally:
+            feeds.forget(self)
+
+
+class LiveFeeds:
+    """LiveFeeds is the in-process registry of watched sessions
+    @subscribe: a queue of snapshots for session 'pk', call from the event loop
+    @unsubscribe: stop sending snapshots to 'queue'
+    @publish: tell the viewers of session 'pk' something changed, safe to call from any thread
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._feeds = {}
+
+    def subscribe(self, pk):
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            feed = self._feeds.get(pk)
+            if feed is None or feed.loop is not loop:
+                feed = self._feeds[pk] = SessionFeed(pk, loop)
+                queue = feed.subscribe()
+                loop.create_task(feed.run(self))
+                return queue
+            return feed.subscribe()
+
+    def unsubscribe(self, pk, queue):
+        with self._lock:
+            feed = self._feeds.get(pk)
+        if feed is not None:
+            feed.viewers.discard(queue)
+            # wake the feed so it notices it has no viewers left
+            feed.changed.set()
+
+    def forget(self, feed):
+        with self._lock:
+            if self._feeds.get(feed.pk) is feed:
+                del self._feeds[feed.pk]
+
+    def publish(self, pk):
+        with self._lock:
+            feed = self._feeds.get(pk)
+        if feed is not None:
+            # nobody watching costs nothing, otherwise only a flag is set
+            try:
+                feed.loop.call_soon_threadsafe(feed.changed.set)
+            except RuntimeError:
+                # the event loop serving the feed has shut down
+                self.forget(feed)
+
+
+feeds = LiveFeeds()
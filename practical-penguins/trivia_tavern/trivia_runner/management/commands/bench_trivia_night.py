@@ -0,0 +1,149 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from trivia_runner.bench import cleanup, make_session
+from trivia_tavern.instrumentation import StatsStore
+from twilio_messenger.outbox import outbox
+
+
+class Phase:
+    """Phase collects the timings of one part of the night
+    @webhook: (seconds, queries) of every text posted to sms_reply
+    @host: (seconds, queries) of every request the host made to active_trivia
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.webhook = []
+        self.host = []
+        self.errors = 0
+        self.wall = 0.0
+        self._lock = threading.Lock()
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    @staticmethod
+    def summary(requests):
+        if not requests:
+            return 'none'
+        latencies = sorted(seconds for seconds, _ in requests)
+        queries = [count for _, count in requests]
+        return (f'{len(requests)} requests, p50 {statistics.median(latencies) * 1000:.1f}ms '
+                f'p99 {StatsStore.percentile(latencies, 0.99) * 1000:.1f}ms, '
+                f'queries avg {statistics.mean(queries):.1f} max {max(queries)}')
+
+
+class Command(BaseCommand):
+    help = ('Load test a whole trivia night in this process: simulated phones text the sms_reply webhook '
+            'while a host drives active_trivia through setup, questions, times up and results. '
+            'Reports latency, query counts and wall time for every phase, then removes everything it made')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=500)
+        parser.add_argument('--questions', type=int, default=5)
+        parser.add_argument('--concurrency', type=int, default=16, help='phones texting at the same time')
+        parser.add_argument('--correct', type=float, default=0.5, help='share of answers that are right')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--senders', type=int, default=1, help='size of the sender number pool')
+        parser.add_argument('--sender-rate', type=float, default=None,
+                            help='throttle every sender number to this many texts per second like a carrier')
+        parser.add_argument('--max-webhook-queries', type=int, default=None,
+                            help='fail if any text took more queries than this')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.phones = [f'+1888{i:07d}' for i in range(options['players'])]
+        # texts are recorded instead of sent, the outbox still does all of its work
+        with override_settings(SMS_TRANSPORT='twilio_messenger.transports.MemoryTransport',
+                               SMS_TRANSPORT_OPTIONS={}, SMS_SENDER_RATE=options['sender_rate'],
+                               HOST_TWILIO_NUMBERS=[f'+1555010{i:04d}' for i in range(options['senders'])]):
+            active_quiz = make_session('bench_trivia_night', options['questions'])
+            try:
+                with ThreadPoolExecutor(max_workers=options['concurrency'],
+                                        thread_name_prefix='bench-phone') as self.phone_pool:
+                    phases = self.play(active_quiz, options)
+            finally:
+                outbox.drain()
+                cleanup(active_quiz, self.phones)
+
+        for phase in phases:
+            self.stdout.write(f'{phase.name:>12}: {phase.wall:7.3f}s wall, {phase.errors} errors')
+            self.stdout.write(f'{"webhook":>12}  {Phase.summary(phase.webhook)}')
+            self.stdout.write(f'{"host":>12}  {Phase.summary(phase.host)}')
+        self.stdout.write(f'{"total":>12}: {sum(phase.wall for phase in phases):7.3f}s wall')
+
+        budget = options['max_webhook_queries']
+        worst = max((count for phase in phases for _, count in phase.webhook), default=0)
+        if budget is not None and worst > budget:
+            raise CommandError(f'a text took {worst} queries, the budget is {budget}')
+
+    def play(self, active_quiz, options):
+        host = Client(HTTP_HOST='localhost')
+        host.force_login(active_quiz.session_master)
+        url = reverse('activequiz', kwargs={'pk': active_quiz.pk})
+
+        setup = Phase('setup')
+        with self.timed(setup):
+            self.request(setup, setup.host, host.get, url)
+            self.texts(setup, [(phone, active_quiz.session_code) for phone in self.phones])
+            self.texts(setup, [(phone, f'team{i}') for i, phone in enumerate(self.phones)])
+        phases = [setup]
+
+        for index in range(1, options['questions'] + 1):
+            phase = Phase(f'question {index}')
+            with self.timed(phase):
+                self.request(phase, phase.host, host.post, url, {'next-question': ''})
+                answers = [(phone, f'Answer {index}' if self.rng.random() < options['correct'] else 'no idea')
+                           for phone in self.phones]
+                self.texts(phase, answers)
+                self.request(phase, phase.host, host.post, url, {'times-up': ''})
+            phases.append(phase)
+
+        results = Phase('results')
+        with self.timed(results):
+            self.request(results, results.host, host.post, url, {'show-results': ''})
+        phases.append(results)
+        return phases
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        yield
+        # a phase is over once every text it queued has been delivered
+        outbox.drain()
+        phase.wall = time.perf_counter() - start
+        self.stdout.write(f'{phase.name} done in {phase.wall:.3f}s')
+
+    @staticmethod
+    def request(phase, timings, method, *args):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = method(*args)
+            timings.append((time.perf_counter() - start, len(queries)))
+        if response.status_code != 200:
+            phase.error()
+
+    def texts(self, phase, texts):
+        """every phone sends its text at about the same time, each from its own test client"""
+        def text(phone, body):
+            try:
+                self.request(phase, phase.webhook, Client(HTTP_HOST='localhost').post, reverse('sms_reply'),
+                             {'From': phone, 'Body': body, 'MessageSid': f'SM{uuid.uuid4().hex}'})
+            except Exception:
+                phase.error()
+            finally:
+                connection.close()
+        list(self.phone_pool.map(lambda args: text(*args), texts))
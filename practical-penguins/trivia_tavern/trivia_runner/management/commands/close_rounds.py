@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trivia_runner.rounds import close_expired_rounds
+
+
+class Command(BaseCommand):
+    help = 'Time out every round past its deadline, optionally polling forever'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forever', action='store_true',
+                            help='keep polling for expired rounds instead of exiting')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to sleep between polls when running with --forever')
+
+    def handle(self, *args, **options):
+        while True:
+            closed = close_expired_rounds()
+            if closed:
+                self.stdout.write(f'closed {closed} rounds')
+            if not options['forever']:
+                return
+            time.sleep(options['interval'])
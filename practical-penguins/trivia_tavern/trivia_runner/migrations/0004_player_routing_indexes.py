@@ -0,0 +1,22 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_runner', '0003_phonenumber'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='phone_number',
+            field=models.CharField(db_index=True, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['active_quiz', 'team_name'], name='trivia_runn_active__47a987_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from trivia_builder import matching
+
+
+def snapshot_current_questions(apps, schema_editor):
+    ActiveTriviaQuiz = apps.get_model('trivia_runner', 'ActiveTriviaQuiz')
+    TriviaQuestion = apps.get_model('trivia_builder', 'TriviaQuestion')
+    for active_quiz in ActiveTriviaQuiz.objects.filter(current_question_index__gt=0):
+        question = TriviaQuestion.objects.filter(quiz_id=active_quiz.trivia_quiz_id,
+                                                 question_index=active_quiz.current_question_index).first()
+        if question is not None:
+            answers = [question.question_answer] + question.alternate_answers.splitlines()
+            active_quiz.current_question = question
+            active_quiz.current_question_text = question.question_text
+            active_quiz.current_answer_key = matching.answer_key(question.match_mode, answers,
+                                                                 question.numeric_tolerance)
+            active_quiz.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_builder', '0002_question_match_mode'),
+        ('trivia_runner', '0004_player_routing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activetriviaquiz',
+            name='current_question',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='trivia_builder.TriviaQuestion'),
+        ),
+        migrations.AddField(
+            model_name='activetriviaquiz',
+            name='current_question_text',
+            field=models.CharField(blank=True, default='', max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='activetriviaquiz',
+            name='current_answer_key',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(snapshot_current_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:34
+
+from django.db import migrations, models
+
+from trivia_builder import matching
+
+
+def grade_existing_answers(apps, schema_editor):
+    Answer = apps.get_model('trivia_runner', 'Answer')
+    graded = []
+    for answer in Answer.objects.select_related('question').iterator():
+        question = answer.question
+        answers = [question.question_answer] + question.alternate_answers.splitlines()
+        matcher = matching.compile_answer_key(
+            matching.answer_key(question.match_mode, answers, question.numeric_tolerance))
+        answer.is_correct = matcher.matches(answer.value)
+        answer.points = 1 if answer.is_correct else 0
+        graded.append(answer)
+    Answer.objects.bulk_update(graded, ['is_correct', 'points'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_runner', '0005_activetriviaquiz_current_question'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='is_correct',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(grade_existing_answers, migrations.RunPython.noop),
+    ]
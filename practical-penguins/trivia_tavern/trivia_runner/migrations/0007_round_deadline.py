@@ -0,0 +1,23 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_runner', '0006_answer_grading'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activetriviaquiz',
+            name='round_deadline',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='activetriviaquiz',
+            name='round_timed_out',
+            field=models.BooleanField(default=False),
+        ),
+    ]
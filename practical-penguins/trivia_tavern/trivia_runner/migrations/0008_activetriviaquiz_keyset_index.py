@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trivia_runner', '0007_round_deadline'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activetriviaquiz',
+            index=models.Index(fields=['start_time', 'id'], name='trivia_runn_start_t_c30126_idx'),
+        ),
+    ]
@@ -1,26 +1,40 @@
 import random
 import string
+from datetime import timedelta
 
 from django.contrib.auth.models import User
 from django.db import models
 from django.utils import timezone
 
+from trivia_builder import matching
 from trivia_builder.models import TriviaQuiz, TriviaQuestion
 from phonenumber_field.modelfields import PhoneNumberField
 
 
 class Player(models.Model):
     team_name = models.CharField(max_length=24, default='')
-    phone_number = models.CharField(max_length=12)
+    phone_number = models.CharField(max_length=12, db_index=True)
     # Model name needs to be in quotes according to
     # https://docs.djangoproject.com/en/3.0/ref/models/fields/#foreignkey
     active_quiz = models.ForeignKey('ActiveTriviaQuiz', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # team names only need to be unique within a session
+            models.Index(fields=['active_quiz', 'team_name']),
+        ]
+
     def get_answers(self):
-        answer_set = Answer.objects.filter(player=self)
+        """recap of every answer given by this player in question order, the answers
+        prefetched with Answer.recap_queryset are used when the caller has them"""
+        if 'answer_set' in getattr(self, '_prefetched_objects_cache', {}):
+            answer_set = self.answer_set.all()
+        else:
+            answer_set = Answer.recap_queryset().filter(player=self)
         answers = ""
-        for i, answer in enumerate(answer_set, start=1):
-            if answer.is_correct():
+        for answer in answer_set:
+            i = answer.question.question_index
+            if answer.is_correct:
                 answers += f'Question {i}: your answer: {answer.value} is correct\n'
             else:
                 answers += f'Question {i}: your answer: {answer.value} ' \
@@ -35,9 +49,13 @@ class Answer(models.Model):
     value = models.CharField(max_length=500, default='')
     player = models.ForeignKey(Player, on_delete=models.CASCADE)
     question = models.ForeignKey(TriviaQuestion, on_delete=models.CASCADE)
+    # graded once when the answer comes in
+    is_correct = models.BooleanField(default=False)
+    points = models.IntegerField(default=0)
 
-    def is_correct(self):
-        return self.value.upper() == self.question.question_answer.upper()
+    @staticmethod
+    def recap_queryset():
+        return Answer.objects.select_related('question').order_by('question__question_index')
 
 
 def gen_session_code():
@@ -51,10 +69,58 @@ class ActiveTriviaQuiz(models.Model):
     session_code = models.CharField(max_length=6, unique=True,
                                     default=gen_session_code, editable=False)
     current_question_index = models.IntegerField(default=0)
+    # snapshot of the question being played, refreshed by set_question_index
+    # so answering a question never has to go back to the quiz tables
+    current_question = models.ForeignKey(TriviaQuestion, on_delete=models.SET_NULL,
+                                         null=True, blank=True, related_name='+')
+    current_question_text = models.CharField(max_length=1000, blank=True, default='')
+    current_answer_key = models.TextField(blank=True, default='')
+    # the round clock lives on the server, answers after round_deadline are refused and the
+    # round scheduler closes the round once it passes, round_timed_out makes closing happen once
+    round_deadline = models.DateTimeField(null=True, blank=True, db_index=True)
+    round_timed_out = models.BooleanField(default=False)
     session_master = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quiz_master')
     start_time = models.DateTimeField(default=timezone.now)
     players = models.ManyToManyField(Player, related_name='quiz_players')
 
+    class Meta:
+        indexes = [
+            # the session list pages newest first with (start_time, id) as the cursor
+            models.Index(fields=['start_time', 'id']),
+        ]
+
+    def set_question_index(self, index):
+        """moves the session to question number 'index' (0 is setup, -1 the results)
+        and refreshes the current question snapshot, the caller saves the session
+        """
+        self.current_question_index = index
+        question = None
+        if index > 0:
+            question = TriviaQuestion.objects.filter(quiz_id=self.trivia_quiz_id, question_index=index).first()
+        self.current_question = question
+        self.current_question_text = question.question_text if question else ''
+        self.current_answer_key = question.answer_key() if question else ''
+        if question:
+            # compile the matcher now rather than on the first answer of the round
+            question.matcher()
+
+    def current_matcher(self):
+        return matching.compile_answer_key(self.current_answer_key)
+
+    # the host page saves only these, the round fields are written with their own UPDATEs
+    # so a page load can never undo a timeout the round scheduler just recorded
+    QUESTION_FIELDS = ['current_question_index', 'current_question', 'current_question_text', 'current_answer_key']
+
+    def open_round(self, seconds=None):
+        """opens the current question, players have 'seconds' to answer or as long as it takes"""
+        self.round_deadline = timezone.now() + timedelta(seconds=seconds) if seconds is not None else None
+        self.round_timed_out = False
+        ActiveTriviaQuiz.objects.filter(pk=self.pk).update(round_deadline=self.round_deadline,
+                                                           round_timed_out=False)
+
+    def round_is_over(self):
+        return self.round_timed_out or (self.round_deadline is not None and timezone.now() >= self.round_deadline)
+
     def __str__(self):
         return (f'Active Quiz:{self.trivia_quiz.name} '
                 f'q#:{self.current_question_index} '
@@ -0,0 +1,90 @@
+import heapq
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from trivia_runner.models import ActiveTriviaQuiz
+from twilio_messenger.views import SMSBot
+
+logger = logging.getLogger(__name__)
+
+# how long the scheduler waits before closing rounds again after it failed to
+RETRY_SECONDS = 5
+
+
+def close_expired_rounds(now=None):
+    """times out every round whose deadline has passed, returns how many were closed"""
+    expired = ActiveTriviaQuiz.objects.filter(round_timed_out=False, round_deadline__lte=now or timezone.now())
+    closed = 0
+    for active_trivia_quiz in expired:
+        try:
+            closed += SMSBot.player_timeout(active_trivia_quiz)
+        except Exception:
+            logger.exception('could not close the round of %s', active_trivia_quiz.session_code)
+    return closed
+
+
+class RoundScheduler:
+    """RoundScheduler ends rounds on time even when no host page is open
+    @schedule: make sure a round is closed at 'deadline', once the transaction commits
+
+    One daemon thread per process sleeps until the earliest deadline it knows
+    of and then closes every expired round. On start it also picks up the
+    deadlines of rounds opened before the process started. Closing a round is
+    idempotent, so several processes (or the 'close_rounds' command) can
+    share the work. When closing fails (e.g. the database is locked) it is
+    tried again RETRY_SECONDS later
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._deadlines = []
+        self._thread = None
+
+    def schedule(self, deadline):
+        if deadline is not None:
+            transaction.on_commit(lambda: self._add(deadline))
+
+    def _add(self, deadline):
+        with self._condition:
+            heapq.heappush(self._deadlines, deadline)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='round-scheduler', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        open_rounds = ActiveTriviaQuiz.objects.filter(round_timed_out=False, round_deadline__isnull=False)
+        try:
+            with self._condition:
+                for deadline in open_rounds.values_list('round_deadline', flat=True):
+                    heapq.heappush(self._deadlines, deadline)
+        except Exception:
+            logger.exception('could not load the deadlines of open rounds')
+        finally:
+            connection.close()
+        while True:
+            with self._condition:
+                while not self._deadlines:
+                    self._condition.wait()
+                wait = (self._deadlines[0] - timezone.now()).total_seconds()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                now = timezone.now()
+                while self._deadlines and self._deadlines[0] <= now:
+                    heapq.heappop(self._deadlines)
+            try:
+                close_expired_rounds(now)
+            except Exception:
+                logger.exception('could not close the expired rounds')
+                with self._condition:
+                    heapq.heappush(self._deadlines, now + timedelta(seconds=RETRY_SECONDS))
+            finally:
+                connection.close()
+
+
+scheduler = RoundScheduler()
@@ -0,0 +1,241 @@
+import asyncio
+import threading
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from twilio_messenger.models import OutboundMessage, ScoreTracker
+from twilio_messenger.tests import make_session, memory_transport
+from twilio_messenger.transports import MemoryTransport
+from twilio_messenger.views import SMSBot
+from . import live
+from .asgi import HostEventsApp
+from .models import ActiveTriviaQuiz, Answer
+from .rounds import RoundScheduler, close_expired_rounds
+
+
+# the in-memory test database refuses concurrent writers, so texts go out inline instead of on the drain thread
+@override_settings(SMS_OUTBOX_EAGER=True)
+class BenchTriviaNightTest(TransactionTestCase):
+
+    def test_plays_every_phase_and_cleans_up(self):
+        out = StringIO()
+        # the in-memory test database refuses concurrent writers, so the phones take turns
+        call_command('bench_trivia_night', players=6, questions=2, concurrency=1, stdout=out)
+
+        report = out.getvalue()
+        for phase in ('setup', 'question 1', 'question 2', 'results'):
+            self.assertIn(f'{phase}: ', report)
+        self.assertNotIn('webhook  none', report.split('results:')[0])
+        self.assertNotRegex(report, r'[1-9]\d* errors')
+        self.assertFalse(User.objects.filter(username__startswith='bench_trivia_night_').exists())
+        self.assertFalse(ScoreTracker.objects.exists())
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_query_budget_is_enforced(self):
+        with self.assertRaises(CommandError):
+            call_command('bench_trivia_night', players=2, questions=1, concurrency=1, max_webhook_queries=1,
+                         stdout=StringIO())
+
+
+@memory_transport()
+class RoundDeadlineTest(TestCase):
+
+    def test_late_answers_are_refused(self):
+        active_quiz = make_session(1, question_index=1)
+        active_quiz.open_round(-1)
+        player = active_quiz.player_set.select_related('active_quiz').get()
+        with self.assertNumQueries(0):
+            reply = SMSBot.evaluate_answer('Answer 1', player)
+
+        self.assertIn('time is up', reply)
+        self.assertFalse(Answer.objects.exists())
+        self.assertFalse(ScoreTracker.objects.get().answered_this_round)
+
+    def test_expired_rounds_are_closed_once(self):
+        expired, running = make_session(2, question_index=1), make_session(2, question_index=1)
+        expired.open_round(0)
+        running.open_round(60)
+
+        self.assertEqual(close_expired_rounds(), 1)
+        self.assertEqual(close_expired_rounds(), 0)
+        self.assertEqual(Answer.objects.filter(player__active_quiz=expired).count(), 2)
+        self.assertFalse(Answer.objects.filter(player__active_quiz=running).exists())
+        self.assertEqual(OutboundMessage.objects.filter(body__startswith='TIME IS UP').count(), 2)
+        # the host pressing times up afterwards changes nothing
+        self.assertFalse(SMSBot.player_timeout(expired))
+
+    @override_settings(TRIVIA_ROUND_SECONDS=20)
+    def test_next_question_starts_the_round_clock(self):
+        active_quiz = make_session(3)
+        self.client.force_login(active_quiz.session_master)
+        response = self.client.post(reverse('activequiz', kwargs={'pk': active_quiz.pk}), {'next-question': ''})
+
+        active_quiz.refresh_from_db()
+        self.assertFalse(active_quiz.round_timed_out)
+        self.assertAlmostEqual((active_quiz.round_deadline - timezone.now()).total_seconds(), 20, delta=1)
+        self.assertAlmostEqual(response.context['round_seconds_left'], 20, delta=1)
+
+    def test_refreshing_the_host_page_does_not_resend_the_question(self):
+        active_quiz = make_session(3)
+        self.client.force_login(active_quiz.session_master)
+        url = reverse('activequiz', kwargs={'pk': active_quiz.pk})
+        self.client.post(url, {'next-question': ''})
+        active_quiz.refresh_from_db()
+        sent = OutboundMessage.objects.count()
+
+        response = self.client.get(url)
+
+        self.assertEqual(OutboundMessage.objects.count(), sent)
+        self.assertNotIn('delivery_batch', response.context)
+        self.assertEqual(ActiveTriviaQuiz.objects.get(pk=active_quiz.pk).round_deadline, active_quiz.round_deadline)
+        self.assertGreater(response.context['round_seconds_left'], 0)
+
+
+@memory_transport()
+@override_settings(SMS_OUTBOX_EAGER=True)
+class QuestionBroadcastTest(TransactionTestCase):
+
+    def test_answers_during_the_broadcast_are_graded_against_the_new_question(self):
+        active_quiz = make_session(2, question_index=1)
+        replies = []
+
+        def answer_on_delivery(transport, body, from_, to):
+            # the player answers while the rest of the room is still being texted
+            if body.startswith('Question#2'):
+                replies.append(SMSBot.receive(to, 'Answer 2'))
+            return f'SM{len(replies):032d}'
+
+        self.client.force_login(active_quiz.session_master)
+        with mock.patch.object(MemoryTransport, 'send', autospec=True, side_effect=answer_on_delivery):
+            self.client.post(reverse('activequiz', kwargs={'pk': active_quiz.pk}), {'next-question': ''})
+
+        self.assertEqual(len(replies), 2)
+        answers = Answer.objects.select_related('question')
+        self.assertEqual([(answer.question.question_index, answer.is_correct) for answer in answers],
+                         [(2, True), (2, True)])
+
+
+# texts go out inline so no drain thread is left writing when the test database is flushed
+@memory_transport()
+@override_settings(SMS_OUTBOX_EAGER=True)
+class RoundSchedulerTest(TransactionTestCase):
+
+    def test_round_is_closed_without_the_host(self):
+        active_quiz = make_session(2, question_index=1)
+        active_quiz.open_round(0.2)
+        closed = threading.Event()
+
+        def close_and_tell(now=None):
+            try:
+                return close_expired_rounds(now)
+            finally:
+                closed.set()
+
+        # wait for the scheduler thread instead of polling the database while it writes
+        with mock.patch('trivia_runner.rounds.close_expired_rounds', side_effect=close_and_tell):
+            RoundScheduler().schedule(active_quiz.round_deadline)
+            self.assertTrue(closed.wait(5))
+        self.assertTrue(ActiveTriviaQuiz.objects.get(pk=active_quiz.pk).round_timed_out)
+        self.assertEqual(Answer.objects.filter(value='').count(), 2)
+
+    def test_failed_close_is_tried_again(self):
+        active_quiz = make_session(2, question_index=1)
+        active_quiz.open_round(0.1)
+        closed = threading.Event()
+        attempts = []
+
+        def fail_once(now=None):
+            attempts.append(now)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            try:
+                return close_expired_rounds(now)
+            finally:
+                closed.set()
+
+        with mock.patch('trivia_runner.rounds.close_expired_rounds', side_effect=fail_once), \
+                mock.patch('trivia_runner.rounds.RETRY_SECONDS', 0.1), \
+                self.assertLogs('trivia_runner.rounds', 'ERROR'):
+            RoundScheduler().schedule(active_quiz.round_deadline)
+            self.assertTrue(closed.wait(5))
+        self.assertEqual(len(attempts), 2)
+        self.assertTrue(ActiveTriviaQuiz.objects.get(pk=active_quiz.pk).round_timed_out)
+
+
+@override_settings(LIVE_FEED_COALESCE_SECONDS=0, LIVE_FEED_POLL_SECONDS=60)
+class HostEventsTest(TransactionTestCase):
+
+    def test_viewers_share_one_read_per_change(self):
+        active_quiz = make_session(3, question_index=1)
+        path = reverse('activequiz', kwargs={'pk': active_quiz.pk}) + 'events/'
+        streams = [[], []]
+
+        def answer_once():
+            ScoreTracker.objects.filter(pk=ScoreTracker.objects.first().pk).update(answered_this_round=True)
+            live.feeds.publish(active_quiz.pk)
+
+        async def updates(count):
+            for _ in range(200):
+                if all(sum(b'event: update' in m.get('body', b'') for m in sent) >= count for sent in streams):
+                    return
+                await asyncio.sleep(0.01)
+            self.fail(f'viewers did not get {count} updates')
+
+        async def watch():
+            left = asyncio.Event()
+
+            async def receive():
+                await left.wait()
+                return {'type': 'http.disconnect'}
+
+            def viewer(sent):
+                async def send(message):
+                    sent.append(message)
+                return HostEventsApp(None)({'type': 'http', 'method': 'GET', 'path': path}, receive, send)
+
+            watching = asyncio.gather(*(viewer(sent) for sent in streams))
+            await updates(1)
+            # answers arrive on webhook threads, not on the event loop
+            thread = threading.Thread(target=answer_once)
+            thread.start()
+            await asyncio.get_event_loop().run_in_executor(None, thread.join)
+            await updates(2)
+            left.set()
+            await watching
+
+        with mock.patch.object(live, 'read_snapshot', wraps=live.read_snapshot) as read_snapshot:
+            asyncio.run(watch())
+
+        self.assertEqual(read_snapshot.call_count, 2)
+        for sent in streams:
+            self.assertEqual(sent[0]['headers'][0], (b'content-type', b'text/event-stream'))
+            self.assertIn(b'"answered": 1', sent[-1]['body'])
+            self.assertIn(b'"joined": 3', sent[-1]['body'])
+
+    @override_settings(LIVE_FEED_POLL_SECONDS=0.05)
+    def test_failed_read_does_not_end_the_feed(self):
+        snapshots = []
+
+        async def watch():
+            queue = live.feeds.subscribe(0)
+            snapshots.append(await asyncio.wait_for(queue.get(), 5))
+            live.feeds.unsubscribe(0, queue)
+
+        with mock.patch.object(live, 'read_snapshot', side_effect=[OperationalError('database is locked'),
+                                                                   {'question': 1}]), \
+                self.assertLogs('trivia_runner.live', 'ERROR'):
+            asyncio.run(watch())
+
+        self.assertEqual(snapshots, [{'question': 1}])
+        self.assertNotIn(0, live.feeds._feeds)
+
+    def test_missing_session_has_no_snapshot(self):
+        self.assertIsNone(live.read_snapshot(0))
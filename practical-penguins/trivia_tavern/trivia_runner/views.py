@@ -1,22 +1,28 @@
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.http import HttpResponseNotFound
 from django.shortcuts import render, get_object_or_404
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import DeleteView, ListView
 from django.contrib import messages
 
-from trivia_builder.models import TriviaQuestion
 from trivia_runner.models import ActiveTriviaQuiz
+from twilio_messenger.leaderboard import LiveLeaderboard
 from twilio_messenger.views import SMSBot
+from trivia_tavern.pagination import KeysetPaginationMixin
 
 from .forms import PhoneNumberForm
+from .live import LIVE_LEADERBOARD_SIZE
+from .rounds import scheduler
 
 
-class ActiveTriviaQuizListView(ListView):
+class ActiveTriviaQuizListView(KeysetPaginationMixin, ListView):
     model = ActiveTriviaQuiz
+    queryset = ActiveTriviaQuiz.objects.select_related('trivia_quiz', 'session_master__profile')
     template_name = 'active_sessions.html'
     context_object_name = 'active_quizzes'
-    ordering = ['-start_time']
+    keyset_field = 'start_time'
     paginate_by = 10
 
 
@@ -37,18 +43,28 @@ def setup(request, active_trivia_quiz):
 
 def times_up(request, active_trivia_quiz):
     SMSBot.player_timeout(active_trivia_quiz)
-    cur_question = TriviaQuestion.objects.get(quiz=active_trivia_quiz.trivia_quiz,
-                                              question_index=active_trivia_quiz.current_question_index)
+    # standings so far come from the live leaderboard, not from the database
+    live_scores = {'score_list': LiveLeaderboard(active_trivia_quiz.session_code).top(LIVE_LEADERBOARD_SIZE)}
     return render(request, 'activequiz_question.html',
-                  {'active_trivia_quiz': active_trivia_quiz, 'cur_question': cur_question})
-
-
-def question(request, active_trivia_quiz):
-    SMSBot.send_all_questions(active_trivia_quiz)
-    cur_question = TriviaQuestion.objects.get(quiz=active_trivia_quiz.trivia_quiz,
-                                              question_index=active_trivia_quiz.current_question_index)
-    return render(request, 'activequiz_question.html',
-                  {'active_trivia_quiz': active_trivia_quiz, 'cur_question': cur_question})
+                  {'active_trivia_quiz': active_trivia_quiz, 'tally_results': live_scores})
+
+
+def question(request, active_trivia_quiz, start_round=False):
+    """shows the current question, only 'start_round' texts it to the players
+    so reloading the host page never sends a question twice"""
+    context = {'active_trivia_quiz': active_trivia_quiz}
+    if start_round:
+        context['delivery_batch'] = SMSBot.send_all_questions(active_trivia_quiz, settings.TRIVIA_ROUND_SECONDS)
+        # the round ends on the server at round_deadline whether or not this page stays open
+        scheduler.schedule(active_trivia_quiz.round_deadline)
+    if active_trivia_quiz.round_deadline is not None:
+        seconds_left = 0
+        if not active_trivia_quiz.round_timed_out:
+            seconds_left = max(0, (active_trivia_quiz.round_deadline - timezone.now()).total_seconds())
+        context['round_seconds_left'] = seconds_left
+        # the page only starts counting down once every player has the question
+        context['delivery_seconds'] = max(0, seconds_left - settings.TRIVIA_ROUND_SECONDS)
+    return render(request, 'activequiz_question.html', context)
 
 
 def end_screen(request, active_trivia_quiz):
@@ -63,22 +79,23 @@ def active_trivia(request, pk):
 
     if request.method == 'POST':
         if 'next-question' in request.POST:
-            active_trivia_quiz.current_question_index = active_trivia_quiz.current_question_index + 1
+            active_trivia_quiz.set_question_index(active_trivia_quiz.current_question_index + 1)
         elif 'show-results' in request.POST:
-            active_trivia_quiz.current_question_index = -1
+            active_trivia_quiz.set_question_index(-1)
         elif 'times-up' in request.POST:
             return times_up(request, active_trivia_quiz)
+        # saved before the question goes out, a player answering right away is graded against it
+        active_trivia_quiz.save(update_fields=ActiveTriviaQuiz.QUESTION_FIELDS)
 
     if active_trivia_quiz.current_question_index == 0:
         response = setup(request, active_trivia_quiz)
     elif active_trivia_quiz.current_question_index > 0:
-        response = question(request, active_trivia_quiz)
+        response = question(request, active_trivia_quiz, start_round='next-question' in request.POST)
     elif active_trivia_quiz.current_question_index < 0:
         response = end_screen(request, active_trivia_quiz)
     else:
         return HttpResponseNotFound(f"active_trivia_quiz current_question_index "
                                     f"invalid value {active_trivia_quiz.current_question_index}")
-    active_trivia_quiz.save()
     return response
 
 
@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trivia_tavern.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once django is set up, the sms webhook and the host event streams are served before django
+from trivia_runner.asgi import HostEventsApp  # noqa: E402
+from twilio_messenger.asgi import InboundSMSApp  # noqa: E402
+
+application = HostEventsApp(InboundSMSApp(django_application))
@@ -0,0 +1,188 @@
+"""Request instrumentation for the game loop
+
+When INSTRUMENTATION_ENABLED is set every request (and every text the asgi
+webhook processes in the background) records how many queries it ran, how
+long they took, how long it spent queueing outbound sms, how long the sms
+transport took to send them and its total latency. Texts are sent by the
+outbox drain, so the transport time shows up on 'outbox.drain', or inside
+the request itself with SMS_OUTBOX_EAGER. The last INSTRUMENTATION_HISTORY samples of every view are kept in
+process for the admin stats page, and each sample is also logged as one
+json line on the 'trivia_tavern.instrumentation' logger.
+
+@measure: records one sample for 'name', used by the middleware and the asgi worker
+@timing: adds the time spent in the block to the open sample as a named hook
+@timed: the same as a decorator
+@stats: the store holding the samples
+"""
+import functools
+import json
+import logging
+import math
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+
+# hooks counted as sms enqueue and sms transport time, the rest only show up in the breakdown
+SMS_ENQUEUE_HOOKS = ('SMSBot.send', 'SMSBot.broadcast')
+SMS_HOOKS = ('outbox.transport',)
+
+
+class Sample:
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.db_time = 0.0
+        self.hooks = defaultdict(float)
+        self.total = 0.0
+        self.status = None
+
+    def hook_time(self, hooks):
+        return sum(self.hooks[hook] for hook in hooks if hook in self.hooks)
+
+    @property
+    def sms_enqueue_time(self):
+        return self.hook_time(SMS_ENQUEUE_HOOKS)
+
+    @property
+    def sms_time(self):
+        return self.hook_time(SMS_HOOKS)
+
+    def as_dict(self):
+        return {
+            'view': self.name,
+            'status': self.status,
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'sms_enqueue_ms': round(self.sms_enqueue_time * 1000, 2),
+            'sms_ms': round(self.sms_time * 1000, 2),
+            'total_ms': round(self.total * 1000, 2),
+            'hooks_ms': {hook: round(seconds * 1000, 2) for hook, seconds in self.hooks.items()},
+        }
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+class StatsStore:
+    """StatsStore keeps a rolling window of samples for every view name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def add(self, sample):
+        with self._lock:
+            if sample.name not in self._samples:
+                self._samples[sample.name] = deque(maxlen=settings.INSTRUMENTATION_HISTORY)
+            self._samples[sample.name].append(sample)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    @staticmethod
+    def percentile(values, fraction):
+        return values[max(0, math.ceil(len(values) * fraction) - 1)]
+
+    def summary(self):
+        """one row per view, slowest p99 first"""
+        with self._lock:
+            windows = {name: list(samples) for name, samples in self._samples.items()}
+        rows = []
+        for name, samples in windows.items():
+            latencies = sorted(sample.total * 1000 for sample in samples)
+            hooks = defaultdict(float)
+            for sample in samples:
+                for hook, seconds in sample.hooks.items():
+                    hooks[hook] += seconds * 1000 / len(samples)
+            rows.append({
+                'view': name,
+                'count': len(samples),
+                'p50_ms': statistics.median(latencies),
+                'p99_ms': self.percentile(latencies, 0.99),
+                'queries_avg': statistics.mean(sample.queries for sample in samples),
+                'queries_max': max(sample.queries for sample in samples),
+                'db_ms_avg': statistics.mean(sample.db_time * 1000 for sample in samples),
+                'sms_enqueue_ms_avg': statistics.mean(sample.sms_enqueue_time * 1000 for sample in samples),
+                'sms_ms_avg': statistics.mean(sample.sms_time * 1000 for sample in samples),
+                'hooks_ms_avg': sorted(hooks.items(), key=lambda item: -item[1]),
+            })
+        return sorted(rows, key=lambda row: -row['p99_ms'])
+
+
+stats = StatsStore()
+
+
+@contextmanager
+def measure(name):
+    """records a sample for everything run on this thread inside the block,
+    does nothing when instrumentation is off or a sample is already open"""
+    if not settings.INSTRUMENTATION_ENABLED or getattr(_current, 'sample', None) is not None:
+        yield None
+        return
+    sample = _current.sample = Sample(name)
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(sample.execute_wrapper):
+            yield sample
+    finally:
+        sample.total = time.perf_counter() - start
+        _current.sample = None
+        stats.add(sample)
+        logger.info(json.dumps(sample.as_dict(), sort_keys=True))
+
+
+@contextmanager
+def timing(name):
+    sample = getattr(_current, 'sample', None)
+    if sample is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.hooks[name] += time.perf_counter() - start
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timing(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InstrumentationMiddleware:
+    """records a sample per request under the name of the url it resolved to"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+        with measure(request.path) as sample:
+            response = self.get_response(request)
+            if sample is not None:
+                match = request.resolver_match
+                sample.name = match.view_name if match is not None else request.path
+                sample.status = response.status_code
+        return response
@@ -0,0 +1,127 @@
+"""Keyset pagination for the listing pages
+
+Listings are ordered newest first by a timestamp with the primary key as the
+tie breaker. Instead of a page number every page links to the rows around it
+with a cursor holding the (timestamp, pk) of its first or last row, so page
+1000 is the same indexed range scan as page 1 and rows added in the meantime
+never shift a page. The models carry a composite index on (timestamp, id)
+for this.
+
+The total shown under a listing is approximate, it is counted once and kept
+in the django cache for COUNT_TIMEOUT seconds or until 'count_key' changes.
+
+@KeysetPaginator: pages through a queryset
+@KeysetPaginationMixin: plugs it into a ListView, ordered by 'keyset_field'
+"""
+import base64
+import binascii
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+COUNT_TIMEOUT = 60
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(f'{value.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value, pk = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        value, pk = parse_datetime(value), int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        value = None
+    if value is None:
+        raise Http404('Invalid page cursor')
+    return value, pk
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, cursor, next_cursor=None, previous_cursor=None, paginator=None):
+        self.object_list = object_list
+        # the cursor this page was asked for, '' for the first page
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+
+    def __init__(self, queryset, per_page, field, count_key=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+        self.count_key = count_key
+
+    @property
+    def count(self):
+        """the approximate number of rows, only counted when the cached count expired"""
+        if self.count_key is None:
+            return self.queryset.count()
+        return cache.get_or_set(self.count_key, self.queryset.count, COUNT_TIMEOUT)
+
+    def cursor_for(self, obj):
+        return encode_cursor(getattr(obj, self.field), obj.pk)
+
+    def page(self, after=None, before=None):
+        """the rows after cursor 'after', before cursor 'before' or else the newest rows"""
+        field = self.field
+        if before:
+            value, pk = decode_cursor(before)
+            rows = list(self.queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+                        .order_by(field, 'pk')[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            cursor = f'before:{before}'
+            has_next, has_previous = True, more
+        else:
+            queryset = self.queryset.order_by(f'-{field}', '-pk')
+            cursor = ''
+            if after:
+                value, pk = decode_cursor(after)
+                queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+                cursor = f'after:{after}'
+            rows = list(queryset[:self.per_page + 1])
+            has_next, has_previous = len(rows) > self.per_page, bool(after)
+            rows = rows[:self.per_page]
+        if not rows and cursor:
+            # stepped past either end, e.g. the rows behind the cursor were deleted
+            return self.page()
+        return KeysetPage(rows, cursor,
+                          next_cursor=self.cursor_for(rows[-1]) if has_next else None,
+                          previous_cursor=self.cursor_for(rows[0]) if has_previous else None,
+                          paginator=self)
+
+
+class KeysetPaginationMixin:
+    """KeysetPaginationMixin pages a ListView with ?after=<cursor> and ?before=<cursor>
+    instead of ?page=<number>, newest 'keyset_field' first"""
+    keyset_field = None
+
+    def get_count_key(self):
+        return f'count:{self.model._meta.label_lower}'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_field, self.get_count_key())
+        page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return paginator, page, page.object_list, page.has_other_pages()
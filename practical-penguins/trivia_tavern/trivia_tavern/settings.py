@@ -11,7 +11,6 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
-from twilio.rest import Client
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -53,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'trivia_tavern.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,6 +95,24 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# The live leaderboard is kept here, point this at memcached when running more than one process
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+# Requests
+# https://docs.djangoproject.com/en/3.0/ref/settings/#data-upload-max-number-fields
+# large question formsets post six fields per question, this lets the editor take packs of 1500 questions
+
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -146,4 +164,61 @@ LOGIN_URL = 'login'
 HOST_TWILIO_NUMBER = os.getenv('TWILIO_NUMBER')
 HOST_TWILIO_SID = os.getenv('TWILIO_ACCOUNT_SID')
 HOST_TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-TWILIO_CLIENT = Client(HOST_TWILIO_SID, HOST_TWILIO_AUTH_TOKEN)
+# Outbound texts are spread over every number in TWILIO_NUMBERS (comma separated), each player always
+# gets texts from the same one. Carriers allow a long code about SMS_SENDER_RATE texts per second,
+# set it to None to send without throttling
+HOST_TWILIO_NUMBERS = [number.strip() for number in os.getenv('TWILIO_NUMBERS', HOST_TWILIO_NUMBER or '').split(',')
+                       if number.strip()]
+SMS_SENDER_RATE = 1.0
+SMS_SENDER_BURST = 1
+
+# Players get this many seconds to answer, counted from when the question reached the last of them
+TRIVIA_ROUND_SECONDS = 30
+
+# Host pages stream live updates over asgi, a burst of changes is read once per LIVE_FEED_COALESCE_SECONDS and
+# changes made by other processes show up within LIVE_FEED_POLL_SECONDS
+LIVE_FEED_COALESCE_SECONDS = 0.25
+LIVE_FEED_POLL_SECONDS = 2.0
+LIVE_FEED_HEARTBEAT_SECONDS = 15.0
+
+# Where outbound sms go, see twilio_messenger/transports.py. Use ConsoleTransport to develop
+# without a twilio account, SimulatorTransport plays the phones of a whole room locally
+SMS_TRANSPORT = os.getenv('SMS_TRANSPORT', 'twilio_messenger.transports.TwilioTransport')
+SMS_TRANSPORT_OPTIONS = {}
+
+# Outbound sms are queued in the database and delivered by a pool of worker threads,
+# set SMS_OUTBOX_EAGER to deliver them inside the request instead (useful for tests)
+SMS_OUTBOX_WORKERS = 8
+SMS_OUTBOX_BATCH_SIZE = 100
+SMS_OUTBOX_MAX_ATTEMPTS = 3
+SMS_OUTBOX_EAGER = False
+# messages a drain claimed but did not finish within this many seconds (e.g. the process was restarted)
+# are claimed again by the next drain, keep it well above the time a batch takes to send
+SMS_OUTBOX_LEASE_SECONDS = 300
+
+# Texts received through the asgi webhook are processed on this many threads, the webhook
+# waits up to SMS_INBOUND_REPLY_TIMEOUT seconds to send the reply back in its own response
+SMS_INBOUND_WORKERS = 8
+SMS_INBOUND_REPLY_TIMEOUT = 1.0
+
+# Twilio retries a webhook it got no answer for, texts already seen are skipped for this many seconds
+SMS_DEDUPE_TTL = 60 * 60
+# a retry that arrives while the first delivery is still being processed waits this long for its reply,
+# if it is not ready by then the webhook answers 409 and twilio tries again later
+SMS_DEDUPE_WAIT = 2.0
+
+# Set INSTRUMENTATION=1 to record queries, db time, sms enqueue and send time and latency of every request, the last
+# INSTRUMENTATION_HISTORY requests of each view are shown to staff at /stats/ and logged as json lines
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION') == '1'
+INSTRUMENTATION_HISTORY = 500
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'trivia_tavern.instrumentation': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -21,7 +21,7 @@ from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 from django.views.generic import RedirectView
 
-from trivia_tavern.views import home
+from trivia_tavern.views import home, request_stats
 from users import views as user_views
 
 
@@ -35,6 +35,7 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(template_name='users/logout.html'), name='logout'),
     path('sms/', include('twilio_messenger.urls')),
     path('', home, name='home_page'),
+    path('stats/', request_stats, name='request-stats'),
     path('quiz/', include('trivia_builder.urls')),
     path('activequiz/', include('trivia_runner.urls')),
     path('favicon.ico', RedirectView.as_view(url=staticfiles_storage.url('favicon.ico')))
@@ -1,5 +1,18 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import render, redirect
+
+from trivia_tavern.instrumentation import stats
 
 
 def home(request):
     return render(request, 'home.html')
+
+
+@staff_member_required
+def request_stats(request):
+    if request.method == 'POST':
+        stats.clear()
+        return redirect('request-stats')
+    return render(request, 'stats.html', {'title': 'Stats', 'rows': stats.summary(),
+                                          'instrumentation_enabled': settings.INSTRUMENTATION_ENABLED})
@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import ScoreTracker
+from .models import ScoreTracker, OutboundMessage
 # Register your models here.
 admin.site.register(ScoreTracker)
+admin.site.register(OutboundMessage)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from trivia_tavern.instrumentation import measure
+
+from .dedupe import SeenMessages
+from .views import SMSBot, twiml
+
+logger = logging.getLogger(__name__)
+
+
+class InboundText:
+    """InboundText is one text being processed off the request path
+
+    The webhook waits a short while for the reply so it can go back in the
+    TwiML response. If the worker is not done by then the webhook answers
+    without it and the worker sends the reply through the outbox instead,
+    the lock makes sure exactly one of the two delivers it. A text that
+    failed in time is answered with an error so twilio knows it was lost
+    """
+
+    def __init__(self, from_, body, message_sid=None):
+        self.from_ = from_
+        self.body = body
+        self.message_sid = message_sid
+        self.reply = None
+        self.done = False
+        self.failed = False
+        self.responded = False
+        self.lock = threading.Lock()
+
+    def process(self):
+        """runs SMSBot.receive on a worker thread, outside of any django request,
+        so the thread has to give back its database connection itself"""
+        try:
+            with measure('sms_reply (asgi)'):
+                reply = SMSBot.receive(self.from_, self.body)
+                if self.message_sid:
+                    SeenMessages.record_reply(self.message_sid, reply)
+                with self.lock:
+                    self.reply, self.done = reply, True
+                    late = self.responded
+                if late and reply:
+                    SMSBot.send(reply, self.from_)
+        except Exception:
+            logger.exception('could not process text from %s', self.from_)
+            if self.message_sid:
+                SeenMessages.release(self.message_sid)
+            with self.lock:
+                self.failed = True
+        finally:
+            close_old_connections()
+
+    def take_reply(self):
+        """called once the webhook responds, returns the reply if it is ready"""
+        with self.lock:
+            self.responded = True
+            return self.reply if self.done else None
+
+
+class InboundSMSApp:
+    """InboundSMSApp is an ASGI middleware that serves the twilio webhook at
+    'path' itself and hands every other request to the django 'app'
+
+    SMSBot.receive runs on a pool of SMS_INBOUND_WORKERS threads so a burst of
+    answers at the end of a round never ties up the server. Twilio gets its
+    TwiML response after at most SMS_INBOUND_REPLY_TIMEOUT seconds, with the
+    reply in it when processing finished in time
+    """
+
+    def __init__(self, app, path='/sms/'):
+        self.app = app
+        self.path = path
+        self.pending = set()
+        self._workers = None
+
+    @property
+    def workers(self):
+        if self._workers is None:
+            self._workers = ThreadPoolExecutor(max_workers=settings.SMS_INBOUND_WORKERS,
+                                               thread_name_prefix='sms-inbound')
+        return self._workers
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path or scope['method'] != 'POST':
+            return await self.app(scope, receive, send)
+
+        form = dict(parse_qsl((await self.read_body(receive)).decode()))
+        from_, body, message_sid = form.get('From'), form.get('Body'), form.get('MessageSid')
+        reply, status = None, 200
+        if message_sid and not SeenMessages.claim(message_sid):
+            # twilio retried a text we already have, answer it without touching the database. If the
+            # first delivery is still being processed its worker sends the reply through the outbox
+            reply = SeenMessages.result(message_sid)[1]
+        elif from_ and body is not None:
+            text = InboundText(from_, body, message_sid)
+            await asyncio.wait({self.schedule(text)}, timeout=settings.SMS_INBOUND_REPLY_TIMEOUT)
+            reply = text.take_reply()
+            if text.failed:
+                # like the django view raising, twilio records the error instead of an empty reply
+                status = 500
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/xml; charset=utf-8')],
+        })
+        await send({'type': 'http.response.body', 'body': twiml(reply).encode() if status == 200 else b''})
+
+    @staticmethod
+    async def read_body(receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return body
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                return body
+
+    def schedule(self, text):
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(self.workers, text.process)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return future
+
+    async def drain(self):
+        """waits until every text acknowledged so far has been processed"""
+        while self.pending:
+            await asyncio.gather(*list(self.pending), return_exceptions=True)
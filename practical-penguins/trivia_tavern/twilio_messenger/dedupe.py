@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class SeenMessages:
+    """SeenMessages remembers which inbound texts were already processed,
+    keyed on the MessageSid twilio sends with every webhook call
+    @claim: True the first time a sid is seen, False for a retry
+    @record_reply: store the reply so a retry can get the same answer back
+    @result: (done, reply) of a sid, done is False while it is still being processed
+    @wait_for_reply: result() once the sid is done or 'timeout' seconds have passed
+    @release: forget a sid whose processing failed so a retry runs it again
+
+    Entries expire after SMS_DEDUPE_TTL seconds, long after twilio stops retrying
+    """
+
+    @staticmethod
+    def _key(message_sid):
+        return f'sms-seen:{message_sid}'
+
+    @staticmethod
+    def claim(message_sid) -> bool:
+        # cache.add is atomic, only one of several concurrent retries gets True
+        return cache.add(SeenMessages._key(message_sid), {'done': False, 'reply': None}, settings.SMS_DEDUPE_TTL)
+
+    @staticmethod
+    def record_reply(message_sid, reply):
+        cache.set(SeenMessages._key(message_sid), {'done': True, 'reply': reply}, settings.SMS_DEDUPE_TTL)
+
+    @staticmethod
+    def result(message_sid):
+        seen = cache.get(SeenMessages._key(message_sid)) or {}
+        return seen.get('done', False), seen.get('reply')
+
+    @staticmethod
+    def wait_for_reply(message_sid, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            done, reply = SeenMessages.result(message_sid)
+            if done or time.monotonic() >= deadline:
+                return done, reply
+            time.sleep(0.05)
+
+    @staticmethod
+    def release(message_sid):
+        cache.delete(SeenMessages._key(message_sid))
@@ -0,0 +1,73 @@
+import hashlib
+import heapq
+from typing import List, Tuple
+
+from django.core.cache import cache
+
+from .models import ScoreTracker
+
+# a trivia night is over long before this, it only stops abandoned sessions from piling up
+LEADERBOARD_TIMEOUT = 6 * 60 * 60
+
+
+class LiveLeaderboard:
+    """LiveLeaderboard keeps the team scores of one session in the django cache
+    so the host screen can show a ranking between questions without a query
+    @award: add points to a team, called whenever ScoreTracker points change
+    @top: the best 'k' teams as (ranking, team, points) rows, it reads the
+    counter of every team so it costs one cache round trip and O(teams) work
+    whatever 'k' is, cheap for a room but not for thousands of teams
+    @rebuild: reload the team list and every missing team score from ScoreTracker
+    @invalidate: forget the team list and scores, the next read rebuilds them
+
+    Every team has its own counter so awards from several worker processes are
+    atomic increments. ScoreTracker stays the source of truth: a counter
+    evicted from the cache is rebuilt from it, and the runner rebuilds the
+    board at the start of every round. A rebuild only adds counters that are
+    missing, one it overwrote could lose an award made after ScoreTracker was
+    read. The teams themselves change (a player quits or changes team) through
+    invalidate, which drops the counters as well
+    """
+
+    def __init__(self, session_code: str):
+        self.session_code = session_code
+
+    def _teams_key(self):
+        return f'leaderboard:{self.session_code}:teams'
+
+    def _team_key(self, team_name: str):
+        # team names are free text from an sms, keep them out of the cache key
+        return f'leaderboard:{self.session_code}:team:{hashlib.md5(team_name.encode()).hexdigest()}'
+
+    def rebuild(self) -> List[Tuple[int, str, int]]:
+        score_list = ScoreTracker.get_team_score_list(self.session_code)
+        live = cache.get_many([self._team_key(team) for _, team, _ in score_list])
+        for _, team, points in score_list:
+            if self._team_key(team) not in live:
+                cache.add(self._team_key(team), points, LEADERBOARD_TIMEOUT)
+        cache.set(self._teams_key(), [team for _, team, _ in score_list], LEADERBOARD_TIMEOUT)
+        return score_list
+
+    def invalidate(self):
+        self.clear()
+
+    def award(self, team_name: str, points: int = 1):
+        try:
+            cache.incr(self._team_key(team_name), points)
+        except ValueError:
+            # counter was evicted, ScoreTracker already holds the new points
+            self.rebuild()
+
+    def top(self, k: int) -> List[Tuple[int, str, int]]:
+        teams = cache.get(self._teams_key())
+        if teams is None:
+            return self.rebuild()[:k]
+        scores = cache.get_many([self._team_key(team) for team in teams])
+        if len(scores) < len(teams):
+            return self.rebuild()[:k]
+        ranked = heapq.nsmallest(k, teams, key=lambda team: (-scores[self._team_key(team)], team))
+        return [(i, team, scores[self._team_key(team)]) for i, team in enumerate(ranked, start=1)]
+
+    def clear(self):
+        teams = cache.get(self._teams_key()) or []
+        cache.delete_many([self._teams_key()] + [self._team_key(team) for team in teams])
@@ -0,0 +1,65 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from trivia_runner.bench import cleanup, make_session
+from trivia_tavern.instrumentation import StatsStore
+from twilio_messenger.asgi import InboundSMSApp
+from twilio_messenger.outbox import outbox
+
+
+class Command(BaseCommand):
+    help = ('Load test the asgi sms webhook: a room of players answer a question at the same time, '
+            'reports how fast texts are acknowledged and processed on this single process')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=300)
+        parser.add_argument('--texts', type=int, default=2, help='texts sent by every player')
+
+    def handle(self, *args, **options):
+        with override_settings(SMS_TRANSPORT='twilio_messenger.transports.MemoryTransport', SMS_SENDER_RATE=None):
+            phones = [f'+1999{i:07d}' for i in range(options['players'])]
+            active_quiz = make_session('bench_webhook', question_index=1,
+                                       players=[(phone, f'team{i % 20}') for i, phone in enumerate(phones)])
+            try:
+                asyncio.run(self.run(phones * options['texts']))
+            finally:
+                outbox.drain()
+                cleanup(active_quiz, phones)
+
+    async def run(self, texts):
+        app = InboundSMSApp(get_asgi_application())
+        latencies = []
+
+        async def post(phone):
+            payload = urlencode({'From': phone, 'Body': 'Answer 1'}).encode()
+            scope = {'type': 'http', 'method': 'POST', 'path': app.path, 'headers': []}
+
+            async def receive():
+                return {'type': 'http.request', 'body': payload, 'more_body': False}
+
+            async def send(message):
+                pass
+
+            start = time.perf_counter()
+            await app(scope, receive, send)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[post(phone) for phone in texts])
+        acked = time.perf_counter()
+        await app.drain()
+        processed = time.perf_counter()
+
+        latencies.sort()
+        self.stdout.write(f'{len(texts)} texts acknowledged in {acked - start:.3f}s '
+                          f'({len(texts) / (acked - start):.0f} texts/s), '
+                          f'ack p50 {statistics.median(latencies) * 1000:.2f}ms '
+                          f'p99 {StatsStore.percentile(latencies, 0.99) * 1000:.2f}ms')
+        self.stdout.write(f'{len(texts)} texts processed in {processed - start:.3f}s '
+                          f'({len(texts) / (processed - start):.0f} texts/s sustained)')
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trivia_tavern.instrumentation import measure
+from twilio_messenger.models import OutboundMessage
+from twilio_messenger.outbox import outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbound sms, optionally polling the queue forever'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forever', action='store_true',
+                            help='keep polling the queue instead of exiting once it is empty')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to sleep between polls when running with --forever')
+        parser.add_argument('--requeue', action='store_true',
+                            help='return every message left "sending" to the queue first, without waiting '
+                                 'for SMS_OUTBOX_LEASE_SECONDS')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            requeued = OutboundMessage.objects.filter(status=OutboundMessage.SENDING).update(
+                status=OutboundMessage.PENDING, lease='', leased_time=None)
+            self.stdout.write(f'requeued {requeued} messages')
+        while True:
+            with measure('outbox.drain'):
+                processed = outbox.drain()
+            if processed:
+                self.stdout.write(f'processed {processed} messages')
+            if not options['forever']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twilio_messenger', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('body', models.TextField()),
+                ('recipient', models.CharField(max_length=16)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], db_index=True, default='pending', max_length=7)),
+                ('lease', models.CharField(blank=True, default='', max_length=32)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.CharField(blank=True, default='', max_length=500)),
+                ('sid', models.CharField(blank=True, default='', max_length=34)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('sent_time', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twilio_messenger', '0002_outboundmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='batch',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32),
+        ),
+    ]
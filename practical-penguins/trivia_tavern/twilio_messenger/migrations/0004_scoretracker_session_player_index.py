@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twilio_messenger', '0003_outboundmessage_batch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scoretracker',
+            index=models.Index(fields=['session_code', 'player_phone'], name='twilio_mess_session_993917_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twilio_messenger', '0004_scoretracker_session_player_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='sender',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.8 on 2026-10-18 17:32
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def start_open_leases(apps, schema_editor):
+    # messages already being sent get a lease from now on, they are claimed again once it expires
+    OutboundMessage = apps.get_model('twilio_messenger', 'OutboundMessage')
+    OutboundMessage.objects.filter(status='sending').update(leased_time=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('twilio_messenger', '0005_outboundmessage_sender'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='leased_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_open_leases, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,8 @@
-from typing import Tuple, List, Optional
+from typing import Dict, Tuple, List, Optional
 
 from django.db import models
-from trivia_runner.models import Player
+
+from .throttle import senders
 
 
 class ScoreTracker(models.Model):
@@ -11,33 +12,90 @@ class ScoreTracker(models.Model):
     session_code = models.CharField(max_length=6)
     answered_this_round = models.BooleanField(default=False)
 
-    @staticmethod
-    def get_score_list(session_code: int) -> List[Optional[Tuple[str, int]]]:
-        """get_score_list is a class method that returns all players and their score_list
-        for the specified session"""
-        return [(x.player_phone, x.points) for x in ScoreTracker.objects.filter(session_code=session_code)]
+    class Meta:
+        indexes = [
+            # also serves the session_code-only lookups of the question loop
+            models.Index(fields=['session_code', 'player_phone']),
+        ]
 
     @staticmethod
-    def get_team_score_list(session_code: int) -> List[Optional[Tuple[int, str, int]]]:
-        """As above, but for each team"""
-        # First get all possible team names
-        team_names = [t.team_name for t in Player.objects.all()]
-        team_names = list(dict.fromkeys(team_names))
-        team_scores = []
-        for i, team in enumerate(team_names, start=1):
-            team_track = ScoreTracker.objects.filter(team_name=team, session_code=session_code)
-            team_score = sum([x.points for x in team_track])
-            team_scores.append((i, team, team_score))
-
-        return team_scores
+    def get_team_score_list(session_code: str) -> List[Optional[Tuple[int, str, int]]]:
+        """get_team_score_list is a class method that returns all teams and their
+        summed points for the specified session as (ranking, team, points), best
+        first. The scores are summed by the database in a single grouped query"""
+        team_scores = (ScoreTracker.objects.filter(session_code=session_code)
+                       .values('team_name')
+                       .annotate(score=models.Sum('points'))
+                       .order_by('-score', 'team_name'))
+        return [(i, team['team_name'], team['score']) for i, team in enumerate(team_scores, start=1)]
 
     @staticmethod
     def winner(score_list: List[Optional[Tuple[int, str, int]]]) -> Optional[str]:
         """winner is a class method that returns the winning player
         for the specified session, 'score_list' should be the output
-        of one of the above two functions"""
-        sorted_score_list = sorted(score_list, key=lambda x: x[2], reverse=True)
-        if len(sorted_score_list) > 0:
-            return sorted_score_list[0][1]
+        of get_team_score_list, which is already ranked"""
+        if len(score_list) > 0:
+            return score_list[0][1]
         else:
             return None
+
+
+class OutboundMessage(models.Model):
+    """OutboundMessage is a row in the persistent outbound sms queue,
+    SMSBot.send only enqueues these and the outbox dispatcher delivers them"""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    body = models.TextField()
+    recipient = models.CharField(max_length=16)
+    sender = models.CharField(max_length=16, blank=True, default='')
+    batch = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    lease = models.CharField(max_length=32, blank=True, default='')
+    # when the lease was taken, a lease older than SMS_OUTBOX_LEASE_SECONDS belonged to a dead drain
+    leased_time = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=500, blank=True, default='')
+    sid = models.CharField(max_length=34, blank=True, default='')
+    created_time = models.DateTimeField(auto_now_add=True)
+    sent_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.status} message to {self.recipient}'
+
+    @staticmethod
+    def batch_report(batch: str) -> Dict[str, object]:
+        """batch_report summarises the delivery of a broadcast 'batch',
+        counting messages per status and listing the recipients that
+        could not be reached with the last error twilio gave for each"""
+        batch_messages = OutboundMessage.objects.filter(batch=batch)
+        report = {status: 0 for status, _ in OutboundMessage.STATUS_CHOICES}
+        for row in batch_messages.values('status').annotate(count=models.Count('pk')):
+            report[row['status']] = row['count']
+        report['failures'] = list(batch_messages.filter(status=OutboundMessage.FAILED)
+                                  .values_list('recipient', 'error'))
+        return report
+
+    @staticmethod
+    def projected_delivery(batch: str) -> float:
+        """projected_delivery estimates how many seconds it takes until the
+        whole 'batch' is delivered, every sender number works through the
+        messages queued before the batch first and is throttled to
+        SMS_SENDER_RATE messages per second. Messages of other batches that
+        a drain already handed to the transport are not waited for"""
+        last = OutboundMessage.objects.filter(batch=batch).aggregate(last=models.Max('pk'))['last']
+        if last is None:
+            return 0.0
+        unfinished = (models.Q(pk__lte=last, status=OutboundMessage.PENDING)
+                      | models.Q(batch=batch, status=OutboundMessage.SENDING))
+        queued = (OutboundMessage.objects.filter(unfinished)
+                  .values('sender').annotate(count=models.Count('pk')))
+        return max((senders.projected_seconds(row['count']) for row in queued), default=0.0)
@@ -0,0 +1,138 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from trivia_tavern.instrumentation import measure, timing
+
+from .models import OutboundMessage
+from .throttle import senders
+from .transports import get_transport
+
+logger = logging.getLogger(__name__)
+
+
+def deliver(message):
+    """deliver hands one queued 'message' to the sms transport and returns its sid
+    It runs on a worker thread and never touches the database, the
+    dispatcher records the outcome once the whole batch has come back.
+    The worker waits for the sender number's token bucket first so no
+    number goes over the carrier's throughput
+    """
+    sender = message.sender or senders.sender_for(message.recipient) or settings.HOST_TWILIO_NUMBER
+    senders.acquire(sender)
+    return get_transport().send(message.body, sender, message.recipient)
+
+
+class OutboxDispatcher:
+    """OutboxDispatcher drains the OutboundMessage queue
+    @wake: schedule a drain once the current transaction commits
+    @drain: claim pending messages in batches and deliver them concurrently
+    with at most SMS_OUTBOX_WORKERS twilio calls in flight, retrying each
+    message up to SMS_OUTBOX_MAX_ATTEMPTS times
+
+    Only one drain runs per process at a time, several processes (e.g. the
+    web server and the 'drain_outbox' command) can share the queue because
+    every batch is claimed with a lease before it is sent. A lease older than
+    SMS_OUTBOX_LEASE_SECONDS is taken to belong to a drain that died mid batch
+    and its messages are claimed again
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._draining = False
+        self._rewake = False
+        self._workers = None
+        self._worker_count = None
+
+    @property
+    def workers(self):
+        if self._workers is None or self._worker_count != settings.SMS_OUTBOX_WORKERS:
+            self._worker_count = settings.SMS_OUTBOX_WORKERS
+            self._workers = ThreadPoolExecutor(max_workers=self._worker_count,
+                                               thread_name_prefix='sms-outbox')
+        return self._workers
+
+    def wake(self):
+        if settings.SMS_OUTBOX_EAGER:
+            self.drain()
+        else:
+            transaction.on_commit(self._start)
+
+    def _start(self):
+        with self._lock:
+            if self._draining:
+                # the running drain picks up the new rows before it exits
+                self._rewake = True
+                return
+            self._draining = True
+        threading.Thread(target=self._run, name='sms-outbox-drain', daemon=True).start()
+
+    def _run(self):
+        idle = False
+        try:
+            while not idle:
+                try:
+                    with measure('outbox.drain'):
+                        self.drain()
+                except Exception:
+                    # the next wake drains again, messages claimed by this pass are
+                    # claimed again once their lease runs out
+                    logger.exception('could not drain the sms outbox')
+                with self._lock:
+                    idle = not self._rewake
+                    self._rewake = False
+                    if idle:
+                        self._draining = False
+        finally:
+            if not idle:
+                # never leave the dispatcher marked busy, later wakes would only set _rewake
+                with self._lock:
+                    self._draining = False
+            connection.close()
+
+    def claim(self):
+        """marks up to SMS_OUTBOX_BATCH_SIZE pending or abandoned messages as ours and returns them"""
+        lease = uuid.uuid4().hex
+        now = timezone.now()
+        claimable = Q(status=OutboundMessage.PENDING) | Q(
+            status=OutboundMessage.SENDING, leased_time__lt=now - timedelta(seconds=settings.SMS_OUTBOX_LEASE_SECONDS))
+        pending = (OutboundMessage.objects.filter(claimable)
+                   .order_by('pk').values_list('pk', flat=True)[:settings.SMS_OUTBOX_BATCH_SIZE])
+        OutboundMessage.objects.filter(claimable, pk__in=list(pending)).update(
+            status=OutboundMessage.SENDING, lease=lease, leased_time=now)
+        return list(OutboundMessage.objects.filter(lease=lease, status=OutboundMessage.SENDING))
+
+    def drain(self):
+        """delivers queued messages until the queue is empty, returns how many were processed"""
+        processed = 0
+        while True:
+            batch = self.claim()
+            if not batch:
+                return processed
+            futures = [(message, self.workers.submit(deliver, message)) for message in batch]
+            for message, future in futures:
+                message.attempts += 1
+                try:
+                    with timing('outbox.transport'):
+                        message.sid = future.result() or ''
+                    message.status = OutboundMessage.SENT
+                    message.sent_time = timezone.now()
+                except Exception as e:
+                    # failed messages go back on the queue until they run out of attempts
+                    message.error = str(e)[:500]
+                    if message.attempts < settings.SMS_OUTBOX_MAX_ATTEMPTS:
+                        message.status = OutboundMessage.PENDING
+                    else:
+                        message.status = OutboundMessage.FAILED
+            OutboundMessage.objects.bulk_update(batch, ['status', 'attempts', 'sid', 'sent_time', 'error'])
+            processed += len(batch)
+
+
+outbox = OutboxDispatcher()
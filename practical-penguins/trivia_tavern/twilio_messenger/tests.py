@@ -0,0 +1,636 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from trivia_builder.models import TriviaQuiz, TriviaQuestion
+from trivia_runner.models import ActiveTriviaQuiz, Player, Answer
+from trivia_tavern.instrumentation import measure, stats
+from .asgi import InboundSMSApp
+from .dedupe import SeenMessages
+from .leaderboard import LiveLeaderboard
+from .models import OutboundMessage, ScoreTracker
+from .outbox import outbox
+from .throttle import TokenBucket, senders
+from .transports import get_transport
+from .views import SMSBot
+
+
+def memory_transport(**options):
+    """records outbound texts in get_transport().sent instead of sending them, without throttling"""
+    return override_settings(SMS_TRANSPORT='twilio_messenger.transports.MemoryTransport',
+                             SMS_TRANSPORT_OPTIONS=options, SMS_SENDER_RATE=None)
+
+
+@memory_transport()
+class OutboxTest(TestCase):
+
+    def test_send_only_enqueues(self):
+        message = SMSBot.send('hello', '+15550001111')
+        self.assertEqual(get_transport().sent, [])
+        self.assertEqual(message.status, OutboundMessage.PENDING)
+
+    def test_drain_delivers_with_bounded_concurrency(self):
+        for i in range(20):
+            OutboundMessage.objects.create(body='hi', recipient=f'+1555000{i:04d}')
+        with memory_transport(delay=0.01), override_settings(SMS_OUTBOX_WORKERS=4):
+            client = get_transport()
+            self.assertEqual(outbox.drain(), 20)
+
+        self.assertEqual(len(client.sent), 20)
+        self.assertLessEqual(client.max_in_flight, 4)
+        self.assertGreater(client.max_in_flight, 1)
+        self.assertFalse(OutboundMessage.objects.exclude(status=OutboundMessage.SENT).exists())
+
+    @override_settings(SMS_OUTBOX_LEASE_SECONDS=60)
+    def test_abandoned_leases_are_claimed_again(self):
+        now = timezone.now()
+        abandoned = OutboundMessage.objects.create(body='hi', recipient='+15550001111', lease='dead',
+                                                   status=OutboundMessage.SENDING,
+                                                   leased_time=now - timedelta(seconds=61))
+        in_flight = OutboundMessage.objects.create(body='hi', recipient='+15550002222', lease='busy',
+                                                   status=OutboundMessage.SENDING,
+                                                   leased_time=now - timedelta(seconds=30))
+
+        self.assertEqual(outbox.drain(), 1)
+
+        self.assertEqual([to for _, _, to in get_transport().sent], [abandoned.recipient])
+        self.assertEqual(OutboundMessage.objects.get(pk=abandoned.pk).status, OutboundMessage.SENT)
+        self.assertEqual(OutboundMessage.objects.get(pk=in_flight.pk).lease, 'busy')
+
+    @override_settings(SMS_OUTBOX_EAGER=True)
+    def test_failed_delivery_is_recorded(self):
+        with memory_transport(fail_for=['+15550002222']):
+            ok = SMSBot.send('hello', '+15550001111')
+            bad = SMSBot.send('hello', '+15550002222')
+        ok.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(ok.status, OutboundMessage.SENT)
+        self.assertTrue(ok.sid.startswith('SM'))
+        self.assertEqual(bad.status, OutboundMessage.FAILED)
+        self.assertIn('cannot reach', bad.error)
+
+    def test_failed_drain_does_not_stop_the_outbox(self):
+        drained = threading.Event()
+
+        def wait_until_idle():
+            for _ in range(500):
+                if not outbox._draining:
+                    return True
+                time.sleep(0.01)
+            return False
+
+        def broken_drain():
+            drained.set()
+            raise OperationalError('database is locked')
+
+        with mock.patch.object(outbox, 'drain', side_effect=broken_drain), \
+                self.assertLogs('twilio_messenger.outbox', 'ERROR'):
+            outbox._start()
+            self.assertTrue(drained.wait(5))
+            self.assertTrue(wait_until_idle())
+
+        drained.clear()
+        with mock.patch.object(outbox, 'drain', side_effect=lambda: drained.set()):
+            outbox._start()
+            self.assertTrue(drained.wait(5))
+            self.assertTrue(wait_until_idle())
+
+
+def make_session(num_players, question_index=0):
+    """creates a quiz with two questions and an active session with 'num_players' players"""
+    host = User.objects.create_user(username=f'host{User.objects.count()}', password='pw')
+    quiz = TriviaQuiz.objects.create(name='Pub night', author=host, description='test quiz')
+    for i in (1, 2):
+        TriviaQuestion.objects.create(quiz=quiz, question_index=i,
+                                      question_text=f'Question {i}?', question_answer=f'Answer {i}')
+    active_quiz = ActiveTriviaQuiz(trivia_quiz=quiz, session_master=host)
+    active_quiz.set_question_index(question_index)
+    active_quiz.save()
+    for i in range(num_players):
+        player = Player.objects.create(active_quiz=active_quiz, team_name=f'team{i}',
+                                       phone_number=f'+1555{active_quiz.pk:03d}{i:04d}')
+        ScoreTracker.objects.create(player_phone=player.phone_number, team_name=player.team_name,
+                                    session_code=active_quiz.session_code)
+    return active_quiz
+
+
+@override_settings(SMS_OUTBOX_EAGER=True)
+class BroadcastTest(TestCase):
+
+    def test_broadcast_reaches_only_the_session(self):
+        active_quiz = make_session(5)
+        make_session(3)
+        with memory_transport():
+            client = get_transport()
+            batch = SMSBot.broadcast(active_quiz, 'Question#1: ?')
+
+        recipients = sorted(to for _, _, to in client.sent)
+        self.assertEqual(recipients, sorted(active_quiz.player_set.values_list('phone_number', flat=True)))
+        report = OutboundMessage.batch_report(batch)
+        self.assertEqual(report[OutboundMessage.SENT], 5)
+        self.assertEqual(report['failures'], [])
+
+    def test_broadcast_retries_and_reports_failures(self):
+        active_quiz = make_session(3)
+        flaky, dead, _ = active_quiz.player_set.values_list('phone_number', flat=True)
+        with memory_transport(fail_for=[dead], flaky_for=[flaky]), override_settings(SMS_OUTBOX_MAX_ATTEMPTS=2):
+            batch = SMSBot.broadcast(active_quiz, 'TIME IS UP')
+
+        report = OutboundMessage.batch_report(batch)
+        self.assertEqual(report[OutboundMessage.SENT], 2)
+        self.assertEqual(report[OutboundMessage.FAILED], 1)
+        self.assertEqual(report['failures'], [(dead, f'cannot reach {dead}')])
+        self.assertEqual(OutboundMessage.objects.get(recipient=flaky).attempts, 2)
+
+
+@override_settings(SMS_OUTBOX_EAGER=True)
+@memory_transport()
+class SessionScopeTest(TestCase):
+
+    def setUp(self):
+        self.active_quiz = make_session(3, question_index=1)
+        self.other_quiz = make_session(4, question_index=1)
+
+    def test_question_loop_leaves_other_sessions_alone(self):
+        ScoreTracker.objects.update(answered_this_round=True)
+        SMSBot.send_all_questions(self.active_quiz)
+        self.assertFalse(ScoreTracker.objects.filter(session_code=self.active_quiz.session_code,
+                                                     answered_this_round=True).exists())
+        self.assertEqual(ScoreTracker.objects.filter(session_code=self.other_quiz.session_code,
+                                                     answered_this_round=True).count(), 4)
+
+        SMSBot.player_timeout(self.active_quiz)
+        self.assertFalse(self.other_quiz.player_set.filter(answer__isnull=False).exists())
+
+    def test_results_only_release_the_sessions_players(self):
+        SMSBot.calculate_results(self.active_quiz)
+        self.assertFalse(self.active_quiz.player_set.exists())
+        self.assertEqual(self.other_quiz.player_set.count(), 4)
+
+
+class QuestionLoopQueryCountTest(TestCase):
+
+    def count_queries(self, func, active_quiz):
+        with CaptureQueriesContext(connection) as queries:
+            func(active_quiz)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_players(self):
+        small = make_session(2, question_index=1)
+        large = make_session(25, question_index=1)
+
+        for func in (SMSBot.send_all_questions, SMSBot.player_timeout):
+            self.assertEqual(self.count_queries(func, small), self.count_queries(func, large), func.__name__)
+
+    def test_timeout_fills_in_blank_answers_once(self):
+        active_quiz = make_session(4, question_index=1)
+        answered = active_quiz.player_set.first()
+        ScoreTracker.objects.filter(player_phone=answered.phone_number).update(answered_this_round=True)
+
+        SMSBot.player_timeout(active_quiz)
+        SMSBot.player_timeout(active_quiz)
+
+        self.assertEqual(Answer.objects.filter(value='').count(), 3)
+        self.assertFalse(Answer.objects.filter(player=answered).exists())
+        self.assertFalse(ScoreTracker.objects.filter(answered_this_round=False).exists())
+
+
+class LeaderboardTest(TestCase):
+
+    def test_team_scores_are_summed_and_ranked(self):
+        active_quiz = make_session(0)
+        code = active_quiz.session_code
+        for phone, team, points in [('+1', 'ducks', 1), ('+2', 'geese', 2), ('+3', 'ducks', 3), ('+4', 'swans', 0)]:
+            ScoreTracker.objects.create(player_phone=phone, team_name=team, points=points, session_code=code)
+        ScoreTracker.objects.create(player_phone='+5', team_name='geese', points=10, session_code='OTHER1')
+
+        with self.assertNumQueries(1):
+            score_list = ScoreTracker.get_team_score_list(code)
+        self.assertEqual(score_list, [(1, 'ducks', 4), (2, 'geese', 2), (3, 'swans', 0)])
+        self.assertEqual(ScoreTracker.winner(score_list), 'ducks')
+        self.assertIsNone(ScoreTracker.winner([]))
+
+
+@override_settings(SMS_OUTBOX_EAGER=True)
+@memory_transport()
+class LiveLeaderboardTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.active_quiz = make_session(3, question_index=1)
+        self.board = LiveLeaderboard(self.active_quiz.session_code)
+
+    def test_correct_answers_update_the_board_without_queries(self):
+        self.board.rebuild()
+        player = self.active_quiz.player_set.get(team_name='team1')
+        SMSBot.evaluate_answer('answer 1', player)
+
+        with self.assertNumQueries(0):
+            top = self.board.top(2)
+        self.assertEqual(top, [(1, 'team1', 1), (2, 'team0', 0)])
+        self.assertEqual(top, ScoreTracker.get_team_score_list(self.active_quiz.session_code)[:2])
+
+    def test_board_is_rebuilt_from_score_tracker(self):
+        ScoreTracker.objects.filter(team_name='team2').update(points=5)
+        cache.clear()
+        self.assertEqual(self.board.top(1), [(1, 'team2', 5)])
+        self.board.award('team0', 7)
+        self.assertEqual(self.board.top(1), [(1, 'team0', 7)])
+
+    def test_rebuild_keeps_live_counters(self):
+        self.board.rebuild()
+        # an award that lands between a rebuild reading ScoreTracker and writing the counters
+        ScoreTracker.objects.filter(team_name='team1').update(points=1)
+        self.board.award('team1', 1)
+        with mock.patch.object(ScoreTracker, 'get_team_score_list', return_value=[
+                (1, 'team0', 0), (2, 'team1', 0), (3, 'team2', 0)]):
+            self.board.rebuild()
+        self.assertEqual(self.board.top(1), [(1, 'team1', 1)])
+
+    def test_team_changes_reset_the_counters(self):
+        self.board.award('team1', 2)
+        ScoreTracker.objects.filter(team_name='team1').update(points=2)
+        self.board.rebuild()
+        SMSBot.player_quit(self.active_quiz.player_set.get(team_name='team1'))
+        self.assertEqual([team for _, team, _ in self.board.top(3)], ['team0', 'team2'])
+
+
+@memory_transport()
+class InboundRoutingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def text(self, from_, body, **extra):
+        return self.client.post(reverse('sms_reply'), {'From': from_, 'Body': body, **extra})
+
+    def test_session_code_registers_player(self):
+        active_quiz = make_session(0)
+        response = self.text('+15551230000', active_quiz.session_code)
+        self.assertTrue(active_quiz.player_set.filter(phone_number='+15551230000').exists())
+        self.assertEqual(response['Content-Type'], 'text/xml')
+        self.assertIn(b'<Message>You registered to play', response.content)
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_team_names_are_only_taken_within_a_session(self):
+        make_session(1)  # already has a 'team0'
+        active_quiz = make_session(0)
+        self.text('+15551230000', active_quiz.session_code)
+        self.text('+15551230000', 'team0')
+        self.assertEqual(active_quiz.player_set.get().team_name, 'team0')
+
+        self.text('+15551239999', active_quiz.session_code)
+        self.text('+15551239999', 'team0')
+        self.assertEqual(active_quiz.player_set.get(phone_number='+15551239999').team_name, '')
+
+    def test_retried_text_is_only_processed_once(self):
+        active_quiz = make_session(1, question_index=1)
+        phone = active_quiz.player_set.get().phone_number
+        first = self.text(phone, 'Answer 1', MessageSid='SM1')
+        with self.assertNumQueries(0):
+            retry = self.text(phone, 'Answer 1', MessageSid='SM1')
+
+        self.assertEqual(first.content, retry.content)
+        self.assertIn(b'Thanks for your answer', retry.content)
+        self.assertEqual(Answer.objects.count(), 1)
+        self.assertEqual(ScoreTracker.objects.get(player_phone=phone).points, 1)
+
+        self.assertIn(b'already answered', self.text(phone, 'Answer 1', MessageSid='SM2').content)
+
+    @override_settings(SMS_DEDUPE_WAIT=0)
+    def test_retry_of_a_text_still_being_processed_is_refused(self):
+        active_quiz = make_session(1, question_index=1)
+        phone = active_quiz.player_set.get().phone_number
+        SeenMessages.claim('SM1')
+
+        self.assertEqual(self.text(phone, 'Answer 1', MessageSid='SM1').status_code, 409)
+        self.assertFalse(Answer.objects.exists())
+
+        SeenMessages.record_reply('SM1', 'Thanks for your answer!')
+        self.assertIn(b'Thanks for your answer!', self.text(phone, 'Answer 1', MessageSid='SM1').content)
+
+    def test_retry_waits_for_the_reply_of_the_first_delivery(self):
+        SeenMessages.claim('SM1')
+        threading.Timer(0.1, SeenMessages.record_reply, ['SM1', 'Thanks for your answer!']).start()
+
+        response = self.text('+15551230000', 'Answer 1', MessageSid='SM1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Thanks for your answer!', response.content)
+
+    def test_routing_cost_does_not_grow_with_sessions(self):
+        active_quiz = make_session(1)
+        with CaptureQueriesContext(connection) as few_sessions:
+            self.text('+15551230000', active_quiz.session_code)
+        for _ in range(10):
+            make_session(2)
+        with CaptureQueriesContext(connection) as many_sessions:
+            self.text('+15551239999', active_quiz.session_code)
+        self.assertEqual(len(few_sessions), len(many_sessions))
+
+
+SENDERS = ['+15550100001', '+15550100002', '+15550100003']
+
+
+@memory_transport()
+@override_settings(HOST_TWILIO_NUMBERS=SENDERS)
+class SenderPoolTest(TestCase):
+
+    def test_players_stick_to_one_sender(self):
+        recipients = [f'+1555123{i:04d}' for i in range(30)]
+        assigned = {recipient: senders.sender_for(recipient) for recipient in recipients}
+        self.assertEqual(assigned, {recipient: senders.sender_for(recipient) for recipient in recipients})
+        self.assertEqual(set(assigned.values()), set(SENDERS))
+
+    def test_token_bucket_books_slots_at_the_rate(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        waits = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.1, places=2)
+        self.assertAlmostEqual(waits[3], 0.2, places=2)
+
+    @override_settings(SMS_SENDER_RATE=50, SMS_OUTBOX_WORKERS=8, HOST_TWILIO_NUMBERS=SENDERS[:1])
+    def test_drain_is_throttled_per_sender(self):
+        for i in range(11):
+            SMSBot.send('hi', f'+1555000{i:04d}')
+        start = time.perf_counter()
+        outbox.drain()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.18)
+        self.assertEqual({from_ for _, from_, _ in get_transport().sent}, {SENDERS[0]})
+
+    @override_settings(SMS_SENDER_RATE=1.0)
+    def test_projected_delivery_of_a_broadcast(self):
+        active_quiz = make_session(12, question_index=1)
+        SMSBot.send('already queued', active_quiz.player_set.first().phone_number)
+        batch = SMSBot.broadcast(active_quiz, 'Question#1: Question 1?')
+
+        per_sender = {}
+        for message in OutboundMessage.objects.all():
+            self.assertEqual(message.sender, senders.sender_for(message.recipient))
+            per_sender[message.sender] = per_sender.get(message.sender, 0) + 1
+        self.assertEqual(OutboundMessage.projected_delivery(batch), max(per_sender.values()) - 1)
+
+        self.client.force_login(active_quiz.session_master)
+        status = self.client.get(reverse('sms-batch-status', args=[batch])).json()
+        self.assertEqual(status['remaining'], 12)
+        self.assertEqual(status['projected_seconds'], max(per_sender.values()) - 1)
+
+    @override_settings(SMS_SENDER_RATE=1.0, SMS_SENDER_BURST=1, HOST_TWILIO_NUMBERS=SENDERS[:1])
+    def test_messages_in_flight_are_not_waited_for(self):
+        active_quiz = make_session(2, question_index=1)
+        phone = active_quiz.player_set.first().phone_number
+        earlier = [SMSBot.send('already queued', phone).pk for _ in range(3)]
+        OutboundMessage.objects.filter(pk__in=earlier[:2]).update(status=OutboundMessage.SENDING, lease='other')
+        batch = SMSBot.broadcast(active_quiz, 'Question#1: Question 1?')
+        OutboundMessage.objects.filter(batch=batch, recipient=phone).update(status=OutboundMessage.SENDING)
+
+        # one earlier message and both of the batch are left, the first goes out in the burst
+        self.assertEqual(OutboundMessage.projected_delivery(batch), 2)
+
+    def test_only_the_host_sees_the_delivery_report(self):
+        active_quiz = make_session(2, question_index=1)
+        batch = SMSBot.broadcast(active_quiz, 'Question#1: Question 1?')
+        url = reverse('sms-batch-status', args=[batch])
+
+        self.client.force_login(User.objects.create_user(username='nosy', password='pw'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(active_quiz.session_master)
+        self.assertEqual(self.client.get(url).json()['remaining'], 2)
+
+    def test_host_timer_waits_for_delivery(self):
+        active_quiz = make_session(3)
+        self.client.force_login(active_quiz.session_master)
+        response = self.client.post(reverse('activequiz', kwargs={'pk': active_quiz.pk}), {'next-question': ''})
+        self.assertContains(response, 'Texting the question to every player')
+        self.assertContains(response, reverse('sms-batch-status', args=[response.context['delivery_batch']]))
+
+
+@memory_transport()
+@override_settings(INSTRUMENTATION_ENABLED=True)
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        stats.clear()
+
+    def test_game_loop_requests_are_recorded(self):
+        active_quiz = make_session(1, question_index=1)
+        phone = active_quiz.player_set.get().phone_number
+        with self.assertLogs('trivia_tavern.instrumentation', 'INFO') as logs:
+            self.client.post(reverse('sms_reply'), {'From': phone, 'Body': 'Answer 1'})
+            self.client.post(reverse('activequiz', kwargs={'pk': active_quiz.pk}), {'times-up': ''})
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'sms_reply')
+        self.assertGreater(line['queries'], 0)
+        self.assertIn('SMSBot.evaluate_answer', line['hooks_ms'])
+
+        with self.assertLogs('trivia_tavern.instrumentation', 'INFO'), measure('outbox.drain'):
+            outbox.drain()
+
+        rows = {row['view']: row for row in stats.summary()}
+        self.assertEqual(rows['sms_reply']['count'], 1)
+        self.assertGreater(rows['activequiz']['sms_enqueue_ms_avg'], 0)
+        self.assertEqual(rows['activequiz']['sms_ms_avg'], 0)
+        # the texts themselves are sent by the outbox
+        self.assertGreater(rows['outbox.drain']['sms_ms_avg'], 0)
+        self.assertIn('SMSBot.player_timeout', dict(rows['activequiz']['hooks_ms_avg']))
+
+    def test_stats_page_is_staff_only(self):
+        User.objects.create_user(username='player', password='pw')
+        User.objects.create_user(username='admin', password='pw', is_staff=True)
+        self.client.login(username='player', password='pw')
+        self.assertEqual(self.client.get(reverse('request-stats')).status_code, 302)
+
+        self.client.login(username='admin', password='pw')
+        with self.assertLogs('trivia_tavern.instrumentation', 'INFO'):
+            self.client.get(reverse('home_page'))
+        response = self.client.get(reverse('request-stats'))
+        self.assertContains(response, 'home_page')
+
+    @override_settings(INSTRUMENTATION_ENABLED=False)
+    def test_nothing_is_recorded_when_disabled(self):
+        self.client.get(reverse('home_page'))
+        self.assertEqual(stats.summary(), [])
+
+
+@memory_transport()
+class CurrentQuestionSnapshotTest(TestCase):
+
+    def test_answer_is_graded_against_the_snapshot(self):
+        active_quiz = make_session(1, question_index=1)
+        self.assertEqual(active_quiz.current_question_text, 'Question 1?')
+        self.assertTrue(active_quiz.current_matcher().matches(' answer 1'))
+
+        player = Player.objects.select_related('active_quiz').get(active_quiz=active_quiz)
+        with CaptureQueriesContext(connection) as queries:
+            SMSBot.evaluate_answer('answer 1', player)
+        self.assertFalse(any('trivia_builder_triviaquestion' in q['sql'] for q in queries.captured_queries))
+        self.assertEqual(ScoreTracker.objects.get(player_phone=player.phone_number).points, 1)
+        self.assertEqual(Answer.objects.get().question, active_quiz.current_question)
+
+    def test_snapshot_follows_the_question_index(self):
+        active_quiz = make_session(0, question_index=1)
+        active_quiz.set_question_index(2)
+        self.assertEqual(active_quiz.current_question.question_index, 2)
+        active_quiz.set_question_index(-1)
+        self.assertIsNone(active_quiz.current_question)
+        self.assertEqual(active_quiz.current_question_text, '')
+
+
+@memory_transport()
+class AnswerRecapTest(TestCase):
+
+    def test_grading_is_stored_and_recap_is_ordered(self):
+        active_quiz = make_session(1, question_index=2)
+        player = Player.objects.select_related('active_quiz').get()
+        SMSBot.evaluate_answer('Answer 2', player)
+        active_quiz.set_question_index(1)
+        active_quiz.save()
+        ScoreTracker.objects.update(answered_this_round=False)
+        SMSBot.evaluate_answer('wrong', Player.objects.select_related('active_quiz').get())
+
+        self.assertEqual(list(Answer.objects.order_by('pk').values_list('is_correct', 'points')),
+                         [(True, 1), (False, 0)])
+        with self.assertNumQueries(1):
+            recap = player.get_answers()
+        self.assertEqual(recap, 'Question 1: your answer: wrong does not match Answer 1\n'
+                                'Question 2: your answer: Answer 2 is correct\n')
+
+    def test_results_recap_does_not_query_per_player(self):
+        def results_queries(num_players):
+            active_quiz = make_session(num_players, question_index=1)
+            SMSBot.player_timeout(active_quiz)
+            OutboundMessage.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                SMSBot.calculate_results(active_quiz)
+            self.assertEqual(OutboundMessage.objects.count(), 2 * num_players)
+            return len(queries.captured_queries)
+
+        self.assertEqual(results_queries(2), results_queries(10))
+
+
+# late replies go out inline so no drain thread is left writing when the test database is flushed
+@override_settings(SMS_OUTBOX_EAGER=True)
+@memory_transport()
+class AsgiWebhookTest(TransactionTestCase):
+
+    def post_text(self, app, from_, body, message_sid='', status=200):
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': f'From={from_}&Body={body}&MessageSid={message_sid}'.encode()}
+
+        async def send(message):
+            sent.append(message)
+
+        async def text_then_drain():
+            await app({'type': 'http', 'method': 'POST', 'path': '/sms/'}, receive, send)
+            await app.drain()
+
+        asyncio.run(text_then_drain())
+        self.assertEqual(sent[0]['status'], status)
+        return sent[1]['body']
+
+    def test_reply_rides_on_the_response(self):
+        active_quiz = make_session(0)
+        response = self.post_text(InboundSMSApp(None), '%2B15551230000', active_quiz.session_code)
+
+        self.assertIn(b'<Message>You registered to play', response)
+        self.assertTrue(active_quiz.player_set.filter(phone_number='+15551230000').exists())
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    @override_settings(SMS_INBOUND_REPLY_TIMEOUT=0)
+    def test_slow_reply_is_sent_through_the_outbox(self):
+        active_quiz = make_session(0)
+        response = self.post_text(InboundSMSApp(None), '%2B15551230000', active_quiz.session_code)
+
+        self.assertNotIn(b'<Message>', response)
+        self.assertTrue(OutboundMessage.objects.filter(recipient='+15551230000',
+                                                       body__startswith='You registered').exists())
+
+    def test_failed_text_is_answered_with_an_error(self):
+        active_quiz = make_session(0)
+        with mock.patch.object(SMSBot, 'receive', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('twilio_messenger.asgi', 'ERROR'):
+            response = self.post_text(InboundSMSApp(None), '%2B15551230000', active_quiz.session_code,
+                                      message_sid='SM1', status=500)
+
+        self.assertEqual(response, b'')
+        # twilio's retry is processed again
+        self.assertTrue(SeenMessages.claim('SM1'))
+
+    def test_other_requests_go_to_django(self):
+        paths = []
+
+        async def django_app(scope, receive, send):
+            paths.append(scope['path'])
+
+        asyncio.run(InboundSMSApp(django_app)({'type': 'http', 'method': 'GET', 'path': '/quiz/'}, None, None))
+        self.assertEqual(paths, ['/quiz/'])
+
+    def test_racing_answers_from_one_phone_score_once(self):
+        active_quiz = make_session(1, question_index=1)
+        phone = active_quiz.player_set.get().phone_number
+        start = threading.Barrier(4)
+        replies = []
+
+        def answer():
+            start.wait()
+            try:
+                replies.append(SMSBot.receive(phone, 'Answer 1'))
+            except OperationalError:
+                # sqlite refuses concurrent writers outright instead of making them wait
+                replies.append('database is locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=answer) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(replies), 4)
+        self.assertEqual(sum(reply.startswith('Thanks') for reply in replies), 1)
+        self.assertEqual(Answer.objects.count(), 1)
+        self.assertEqual(ScoreTracker.objects.get(player_phone=phone).points, 1)
+
+
+def join_team(phone, body):
+    if body.startswith('You registered to play'):
+        return 'team0'
+
+
+@override_settings(SMS_OUTBOX_EAGER=True)
+class SimulatorTransportTest(LiveServerTestCase):
+
+    def test_simulated_phone_plays_through_the_webhook(self):
+        active_quiz = make_session(0, question_index=1)
+        phone = '+15551230000'
+        with override_settings(SMS_TRANSPORT='twilio_messenger.transports.SimulatorTransport',
+                               SMS_TRANSPORT_OPTIONS={'url': self.live_server_url + reverse('sms_reply'),
+                                                      'respond': join_team}):
+            simulator = get_transport()
+            simulator.text(phone, active_quiz.session_code)
+            simulator.wait()
+            SMSBot.broadcast(active_quiz, SMSBot.question_msg(1, 'Question 1?'))
+            simulator.text(phone, 'Answer 1').result()
+
+        self.assertTrue(simulator.inbox[phone][0].startswith('You registered to play'))
+        self.assertEqual(simulator.inbox[phone][-2], 'Question#1: Question 1?')
+        self.assertIn('Thanks for your answer', simulator.inbox[phone][-1])
+        self.assertEqual(ScoreTracker.objects.get(player_phone=phone).points, 1)
+        self.assertEqual(simulator.latency_report()['replies'], 3)
+        self.assertEqual(simulator.latency_report()['unanswered'], 0)
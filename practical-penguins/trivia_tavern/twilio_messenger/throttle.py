@@ -0,0 +1,83 @@
+import threading
+import time
+import zlib
+from typing import Optional
+
+from django.conf import settings
+
+
+class TokenBucket:
+    """TokenBucket hands out 'rate' sends per second with bursts of up to
+    'capacity', reserve() books the next free slot and returns how long the
+    caller has to wait for it so concurrent senders queue up fairly"""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+
+class SenderPool:
+    """SenderPool spreads outbound sms over the HOST_TWILIO_NUMBERS
+    @sender_for: the number a recipient always gets its texts from
+    @acquire: blocks until 'sender' may send another message
+    @projected_seconds: how long 'count' queued messages take to go out from one number
+
+    Carriers throttle a long code to about one text per second, every
+    number gets its own token bucket refilled at SMS_SENDER_RATE. With
+    SMS_SENDER_RATE set to None sending is not throttled at all. The buckets
+    live in this process, run a single outbox drainer per sender pool
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._config = None
+
+    @property
+    def numbers(self):
+        return settings.HOST_TWILIO_NUMBERS
+
+    def sender_for(self, recipient: str) -> str:
+        numbers = self.numbers
+        if not numbers:
+            return ''
+        # sticky, a player keeps hearing from the same number for the whole night
+        return numbers[zlib.crc32(recipient.encode()) % len(numbers)]
+
+    def bucket(self, sender: str) -> Optional[TokenBucket]:
+        rate, burst = settings.SMS_SENDER_RATE, settings.SMS_SENDER_BURST
+        if rate is None:
+            return None
+        with self._lock:
+            if self._config != (rate, burst):
+                self._config = (rate, burst)
+                self._buckets = {}
+            if sender not in self._buckets:
+                self._buckets[sender] = TokenBucket(rate, burst)
+            return self._buckets[sender]
+
+    def acquire(self, sender: str):
+        bucket = self.bucket(sender)
+        if bucket is not None:
+            time.sleep(bucket.reserve())
+
+    @staticmethod
+    def projected_seconds(count: int) -> float:
+        rate = settings.SMS_SENDER_RATE
+        if rate is None:
+            return 0.0
+        return max(0, count - settings.SMS_SENDER_BURST) / rate
+
+
+senders = SenderPool()
@@ -0,0 +1,218 @@
+"""SMS transports
+
+A transport is what finally hands an outbound text to a phone network. The
+outbox calls get_transport().send() from its worker threads, the transport
+in use is picked by the SMS_TRANSPORT setting (a dotted path) and built with
+the keyword arguments in SMS_TRANSPORT_OPTIONS.
+
+@TwilioTransport: the real thing, the twilio client is only built on first use
+@ConsoleTransport: writes every text to stdout, for local development
+@MemoryTransport: keeps every text in a list, can add delays and failures
+@SimulatorTransport: a fake phone network that texts replies back into the
+'sms_reply' webhook over http and measures how long every reply took
+"""
+import itertools
+import statistics
+import sys
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ElementTree
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from twilio.rest import Client
+
+from trivia_tavern.instrumentation import StatsStore
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """returns the transport configured by SMS_TRANSPORT, built once per process"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = import_string(settings.SMS_TRANSPORT)(**settings.SMS_TRANSPORT_OPTIONS)
+        return _transport
+
+
+@receiver(setting_changed)
+def reset_transport(setting, **kwargs):
+    global _transport
+    if setting in ('SMS_TRANSPORT', 'SMS_TRANSPORT_OPTIONS'):
+        with _transport_lock:
+            _transport = None
+
+
+class Transport:
+    """Transport is the interface every sms transport implements, 'send' is
+    called concurrently from the outbox workers and returns the message sid"""
+
+    def send(self, body, from_, to):
+        raise NotImplementedError
+
+
+class TwilioTransport(Transport):
+
+    def __init__(self, account_sid=None, auth_token=None):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = Client(self.account_sid or settings.HOST_TWILIO_SID,
+                                      self.auth_token or settings.HOST_TWILIO_AUTH_TOKEN)
+            return self._client
+
+    def send(self, body, from_, to):
+        return self.client.messages.create(body=body, from_=from_, to=to).sid
+
+
+class ConsoleTransport(Transport):
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+        self._count = itertools.count(1)
+
+    def send(self, body, from_, to):
+        with self._lock:
+            self.stream.write(f'sms from {from_} to {to}:\n{body}\n\n')
+            self.stream.flush()
+            return f'SMconsole{next(self._count):023d}'
+
+
+class MemoryTransport(Transport):
+    """MemoryTransport records every text in 'sent' as (body, from_, to)
+    @delay: seconds every send takes, to stand in for the twilio api
+    @fail_for: numbers that can never be reached
+    @flaky_for: numbers whose first send fails
+    """
+
+    def __init__(self, delay=0.0, fail_for=(), flaky_for=()):
+        self.delay = delay
+        self.fail_for = set(fail_for)
+        self.flaky_for = set(flaky_for)
+        self.sent = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def send(self, body, from_, to):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+            if to in self.fail_for:
+                raise RuntimeError(f'cannot reach {to}')
+            if to in self.flaky_for:
+                self.flaky_for.remove(to)
+                raise RuntimeError(f'timed out sending to {to}')
+            self.sent.append((body, from_, to))
+            return f'SM{len(self.sent):032d}'
+
+
+class SimulatorTransport(Transport):
+    """SimulatorTransport plays every phone in a game
+    @text: a phone texts 'body' to the webhook at 'url', like twilio would
+    @respond: called with (phone, body) for every text a phone receives,
+    whatever it returns is texted back to the webhook
+    @wait: blocks until every text sent so far has been answered by the webhook
+    @latency_report: how long phones waited to hear back after texting
+
+    A reply counts when it comes back in the webhook's TwiML response or
+    when the outbox sends it later, phones text from 'workers' threads so a
+    whole room can answer at once
+    """
+
+    def __init__(self, url='http://127.0.0.1:8000/sms/', respond=None, workers=32, timeout=30):
+        self.url = url
+        self.respond = import_string(respond) if isinstance(respond, str) else respond
+        self.timeout = timeout
+        self.inbox = {}
+        self.latencies = []
+        self.errors = []
+        self._waiting = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._phones = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sms-simulator')
+
+    def text(self, phone, body):
+        """returns a future for the text, it resolves once the webhook has answered"""
+        with self._lock:
+            self._waiting.setdefault(phone, []).append(time.perf_counter())
+            future = self._phones.submit(self._post, phone, body)
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                return
+            futures.wait(pending)
+
+    def _post(self, phone, body):
+        payload = urlencode({'From': phone, 'Body': body, 'MessageSid': f'SM{uuid.uuid4().hex}'}).encode()
+        try:
+            with urlopen(self.url, data=payload, timeout=self.timeout) as response:
+                document = ElementTree.fromstring(response.read())
+        except Exception as e:
+            with self._lock:
+                self.errors.append((phone, str(e)))
+                waiting = self._waiting.get(phone)
+                if waiting:
+                    waiting.pop(0)
+            return
+        for message in document.iter('Message'):
+            self.receive(phone, message.text or '')
+
+    def send(self, body, from_, to):
+        self.receive(to, body)
+        return f'SMsim{uuid.uuid4().hex[:27]}'
+
+    def receive(self, phone, body):
+        with self._lock:
+            self.inbox.setdefault(phone, []).append(body)
+            waiting = self._waiting.get(phone)
+            if waiting:
+                self.latencies.append(time.perf_counter() - waiting.pop(0))
+        if self.respond is not None:
+            reply = self.respond(phone, body)
+            if reply is not None:
+                self.text(phone, reply)
+
+    def latency_report(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            unanswered = sum(len(waiting) for waiting in self._waiting.values())
+        if not latencies:
+            return {'replies': 0, 'unanswered': unanswered, 'errors': len(self.errors)}
+        return {
+            'replies': len(latencies),
+            'unanswered': unanswered,
+            'errors': len(self.errors),
+            'p50': statistics.median(latencies),
+            'p99': StatsStore.percentile(latencies, 0.99),
+            'max': latencies[-1],
+        }
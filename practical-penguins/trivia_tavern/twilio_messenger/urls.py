@@ -1,7 +1,8 @@
 from django.urls import path
 
-from .views import sms_reply
+from .views import sms_reply, batch_status
 
 urlpatterns = [
-    path('', sms_reply, name='sms_reply')
+    path('', sms_reply, name='sms_reply'),
+    path('batch/<str:batch>/', batch_status, name='sms-batch-status'),
 ]
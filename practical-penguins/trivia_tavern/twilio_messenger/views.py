@@ -1,35 +1,63 @@
+import uuid
+
 from django.conf import settings
-from django.shortcuts import redirect
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from twilio.twiml.messaging_response import MessagingResponse
 
 from trivia_builder.models import TriviaQuestion
+from trivia_runner.live import feeds
 from trivia_runner.models import ActiveTriviaQuiz, Player, Answer
-from .models import ScoreTracker
+from trivia_tavern.instrumentation import timed
+from .dedupe import SeenMessages
+from .leaderboard import LiveLeaderboard
+from .models import ScoreTracker, OutboundMessage
+from .outbox import outbox
+from .throttle import senders
 
 
 class SMSBot:
     """SMSBot is a helper class to implement the main receving 'sms_reply'
     functions and process the input received from texts
     @send: send a string 'msg' to a phone number 'recipient'
+    @broadcast: send a string 'msg' to every player of 'active_quiz'
+    @receive: route a text 'body' received from the phone number 'from_'
     @register: register a new player with a 'phone_number' for requested 'active_quiz'
     @send_question: sends question #'qnumber' from a 'trivia_quiz' to 'player'
     """
 
     @staticmethod
+    @timed('SMSBot.send')
     def send(msg: str, recipient):
-        """send will send a message 'msg' to a 'recipient'
+        """send will queue a message 'msg' to a 'recipient'
         This is not really a view method, but a helper method for the main
-        sms_reply method
+        sms_reply method. The twilio call itself happens on the outbox
+        worker pool so the calling request never waits on it
         """
-        twilio_number = settings.HOST_TWILIO_NUMBER
-        client = settings.TWILIO_CLIENT
-        message = client.messages.create(
-            body=msg,
-            from_=twilio_number,
-            to=recipient
-        )
+        message = OutboundMessage.objects.create(body=msg, recipient=recipient, sender=senders.sender_for(recipient))
+        outbox.wake()
         return message
 
+    @staticmethod
+    @timed('SMSBot.broadcast')
+    def broadcast(active_quiz, msg: str):
+        """broadcast queues one copy of 'msg' for every player in 'active_quiz'
+        The recipients are fetched with a single query and queued with a single
+        insert, the outbox then fans the batch out concurrently. Returns the
+        batch id, pass it to OutboundMessage.batch_report to see which
+        recipients could not be reached
+        """
+        batch = uuid.uuid4().hex
+        recipients = active_quiz.player_set.values_list('phone_number', flat=True)
+        OutboundMessage.objects.bulk_create(
+            [OutboundMessage(body=msg, recipient=recipient, sender=senders.sender_for(recipient), batch=batch)
+             for recipient in recipients])
+        outbox.wake()
+        return batch
+
     @staticmethod
     def register(phone_number, active_quiz):
         """registers a default player account with the ActiveTriviaQuiz 'quiz'
@@ -43,21 +71,25 @@ class SMSBot:
     def send_question(question, player):
         """sends the specified question 'question' to 'player'
         """
-        msg = f'Question#{question.question_index}: {question.question_text}'
-        SMSBot.send(msg, player.phone_number)
+        SMSBot.send(SMSBot.question_msg(question.question_index, question.question_text), player.phone_number)
 
     @staticmethod
+    def question_msg(question_index, question_text):
+        return f'Question#{question_index}: {question_text}'
+
+    @staticmethod
+    @timed('SMSBot.register_with_code')
     def register_with_code(number, active_quiz):
         welcome = (f'You registered to play "{active_quiz.trivia_quiz.name}." '
                    f'Please choose a team name to join'
                    f'If you didn\'t mean to do this, text !quit at any time')
-        SMSBot.send(welcome, number)
         new_player = SMSBot.register(number, active_quiz)
         new_player.save()
         active_quiz.players.add(new_player)
-        active_quiz.save()
+        return welcome
 
     @staticmethod
+    @timed('SMSBot.pick_team')
     def pick_team(team, player):
         player_quiz = player.active_quiz
         player.team_name = team
@@ -67,17 +99,20 @@ class SMSBot:
         ScoreTracker.objects.create(player_phone=player.phone_number,
                                     team_name=player.team_name,
                                     session_code=player_quiz.session_code)
-        SMSBot.send(msg, player.phone_number)
+        LiveLeaderboard(player_quiz.session_code).invalidate()
+        transaction.on_commit(lambda: feeds.publish(player_quiz.pk))
+        return msg
 
     @staticmethod
     def player_quit(player):
         player_quiz = player.active_quiz
         from_ = player.phone_number
-        score_track = ScoreTracker.objects.get(player_phone=player.phone_number,
-                                               session_code=player_quiz.session_code)
         player.delete()
-        score_track.delete()
-        SMSBot.send('You have left the quiz.', from_)
+        # players that quit before picking a team have no score to clean up
+        ScoreTracker.objects.filter(player_phone=from_, session_code=player_quiz.session_code).delete()
+        LiveLeaderboard(player_quiz.session_code).invalidate()
+        transaction.on_commit(lambda: feeds.publish(player_quiz.pk))
+        return 'You have left the quiz.'
 
     @staticmethod
     def pre_quiz(body, player):
@@ -89,59 +124,92 @@ class SMSBot:
                                                    session_code=player_quiz.session_code)
             score_track.team_name = player.team_name
             score_track.save()
-            SMSBot.send(f'Your team has been updated! You are now on team "{player.team_name}"', player.phone_number)
+            LiveLeaderboard(player_quiz.session_code).invalidate()
+            return f'Your team has been updated! You are now on team "{player.team_name}"'
         else:
             please_wait = ('The host hasn\'t started the quiz yet, patience is a virtue! '
                            'If you want to change teams, text !EDIT/newteamname before the quiz starts. '
                            'Please make sure you let your teammates know though!'
                            )
-            SMSBot.send(please_wait, player.phone_number)
+            return please_wait
 
     @staticmethod
+    @timed('SMSBot.evaluate_answer')
     def evaluate_answer(body, player):
         player_quiz = player.active_quiz
-        current_question = TriviaQuestion.objects.get(quiz=player_quiz.trivia_quiz,
-                                                      question_index=player_quiz.current_question_index)
-
-        score_track = ScoreTracker.objects.get(player_phone=player.phone_number,
-                                               session_code=player_quiz.session_code)
-        if score_track.answered_this_round:
-            return SMSBot.send('You already answered! Don\'t cheat!', player.phone_number)
-
-        ans = Answer.objects.create(value=body, player=player, question=current_question)
-        if ans.is_correct():
-            score_track.points += 1
-        score_track.answered_this_round = True
-        score_track.save()
-        msg = 'Thanks for your answer! Please wait for the next question...'
-        return SMSBot.send(msg, player.phone_number)
+        if player_quiz.round_is_over():
+            # the session was loaded with the player, refusing a late answer costs no query
+            return 'Sorry, time is up for this question! Please wait for the next one...'
+        # grade against the session's snapshot of the question, no quiz tables involved
+        correct = player_quiz.current_matcher().matches(body)
+        points = 1 if correct else 0
+
+        with transaction.atomic():
+            # answering and scoring is one conditional UPDATE, of two texts racing in from the
+            # same phone only one can flip answered_this_round and the points never get lost
+            answered = ScoreTracker.objects.filter(player_phone=player.phone_number,
+                                                   session_code=player_quiz.session_code,
+                                                   answered_this_round=False
+                                                   ).update(answered_this_round=True, points=F('points') + points)
+            if not answered:
+                return 'You already answered! Don\'t cheat!'
+            Answer.objects.create(value=body, player=player, question_id=player_quiz.current_question_id,
+                                  is_correct=correct, points=points)
+        if points:
+            LiveLeaderboard(player_quiz.session_code).award(player.team_name, points)
+        transaction.on_commit(lambda: feeds.publish(player_quiz.pk))
+        return 'Thanks for your answer! Please wait for the next question...'
 
     @staticmethod
+    @timed('SMSBot.player_timeout')
     def player_timeout(active_trivia_quiz):
-        for player in Player.objects.all():
-            score_track = ScoreTracker.objects.get(player_phone=player.phone_number,
-                                                   session_code=active_trivia_quiz.session_code)
-
-            if not score_track.answered_this_round:
-                current_question = TriviaQuestion.objects.get(quiz=active_trivia_quiz.trivia_quiz,
-                                                              question_index=active_trivia_quiz.current_question_index)
-                Answer.objects.create(value="", player=player, question=current_question)
-                score_track.answered_this_round = True
-                score_track.save()
-            SMSBot.send('TIME IS UP. NO MORE ANSWERS!', player.phone_number)
+        """records a blank answer for every player that did not answer in time
+        and closes the round for the whole session, the number of queries does
+        not depend on how many players are in the session.
+        Both the host's times-up button and the round scheduler call this, only
+        the first call for a round does anything. Returns if it closed the round
+        """
+        with transaction.atomic():
+            closing = ActiveTriviaQuiz.objects.filter(pk=active_trivia_quiz.pk,
+                                                      round_timed_out=False).update(round_timed_out=True)
+            active_trivia_quiz.round_timed_out = True
+            if not closing:
+                return False
+            unanswered = ScoreTracker.objects.filter(session_code=active_trivia_quiz.session_code,
+                                                     answered_this_round=False)
+            # lock the rows, an answer arriving now waits for the round to close and is then refused
+            list(unanswered.select_for_update().values_list('pk', flat=True))
+            late_players = active_trivia_quiz.player_set.filter(
+                phone_number__in=unanswered.values('player_phone'))
+            Answer.objects.bulk_create([Answer(value='', player=player,
+                                               question_id=active_trivia_quiz.current_question_id)
+                                        for player in late_players])
+            unanswered.update(answered_this_round=True)
+        SMSBot.broadcast(active_trivia_quiz, 'TIME IS UP. NO MORE ANSWERS!')
+        transaction.on_commit(lambda: feeds.publish(active_trivia_quiz.pk))
+        return True
 
     @staticmethod
-    def send_all_questions(active_trivia_quiz):
-        cur_question = TriviaQuestion.objects.get(quiz=active_trivia_quiz.trivia_quiz,
-                                                  question_index=active_trivia_quiz.current_question_index)
-        for player in Player.objects.all():
-            score_track = ScoreTracker.objects.get(player_phone=player.phone_number,
-                                                   session_code=active_trivia_quiz.session_code)
-            score_track.answered_this_round = False
-            score_track.save()
-            SMSBot.send_question(cur_question, player)
+    @timed('SMSBot.send_all_questions')
+    def send_all_questions(active_trivia_quiz, round_seconds=None):
+        """texts the current question to every player and opens the round,
+        with 'round_seconds' the round closes that long after the question
+        is projected to have reached the last player. Returns the broadcast batch
+        """
+        # open the new round for everyone in one statement
+        ScoreTracker.objects.filter(session_code=active_trivia_quiz.session_code).update(answered_this_round=False)
+        # fill in live leaderboard scores the cache evicted, once per round
+        LiveLeaderboard(active_trivia_quiz.session_code).rebuild()
+        batch = SMSBot.broadcast(active_trivia_quiz, SMSBot.question_msg(active_trivia_quiz.current_question_index,
+                                                                         active_trivia_quiz.current_question_text))
+        if round_seconds is not None:
+            round_seconds += OutboundMessage.projected_delivery(batch)
+        active_trivia_quiz.open_round(round_seconds)
+        transaction.on_commit(lambda: feeds.publish(active_trivia_quiz.pk))
+        return batch
 
     @staticmethod
+    @timed('SMSBot.calculate_results')
     def calculate_results(active_trivia_quiz):
         # must be filter in order to get multiple questions
         question_set = TriviaQuestion.objects.filter(quiz=active_trivia_quiz.trivia_quiz)
@@ -153,21 +221,75 @@ class SMSBot:
 
         tally_results = {'winner': winner,
                          'score_list': score_list}
-        # release players here
-        for player in Player.objects.all():
-            score_track = ScoreTracker.objects.get(player_phone=player.phone_number,
-                                                   session_code=active_trivia_quiz.session_code)
-
+        points = dict(ScoreTracker.objects.filter(session_code=active_trivia_quiz.session_code)
+                      .values_list('player_phone', 'points'))
+        # release players here, only the ones from this session
+        players = active_trivia_quiz.player_set.prefetch_related(
+            Prefetch('answer_set', queryset=Answer.recap_queryset()))
+        messages = []
+        for player in players:
             goodbye = (f'The session has ended, thanks for playing!\n'
                        f'Team {winner} was the winner!\n'
-                       f'Your score was: {score_track.points}/{len(question_set)}'
+                       f'Your score was: {points.get(player.phone_number, 0)}/{len(question_set)}'
                        )
-
-            SMSBot.send(goodbye, player.phone_number)
-            SMSBot.send(player.get_answers(), player.phone_number)
-            player.delete()
+            sender = senders.sender_for(player.phone_number)
+            messages.append(OutboundMessage(body=goodbye, recipient=player.phone_number, sender=sender))
+            messages.append(OutboundMessage(body=player.get_answers(), recipient=player.phone_number, sender=sender))
+        # one insert for the whole room like broadcast, the recap follows the goodbye in queue order
+        OutboundMessage.objects.bulk_create(messages)
+        outbox.wake()
+        active_trivia_quiz.player_set.all().delete()
+        LiveLeaderboard(active_trivia_quiz.session_code).clear()
         return tally_results
 
+    @staticmethod
+    @timed('SMSBot.receive')
+    def receive(from_, body):
+        """receive routes one inbound text 'body' from the phone number 'from_'
+        to the right SMSBot action, this is what sms_reply and the asgi
+        webhook in twilio_messenger.asgi both run for every text.
+        Returns the reply for the texter, the caller sends it back in the
+        webhook response rather than as a separate message
+        """
+        # check if the text is from a registered Player, can be None
+        # every lookup below goes through an index so this stays flat as sessions pile up
+        player = (Player.objects.filter(phone_number=from_)
+                  .select_related('active_quiz__trivia_quiz')
+                  .order_by('-pk')
+                  .first())
+
+        if body.upper() == '!QUIT':
+            if player is not None:
+                return SMSBot.player_quit(player)
+            return None
+
+        if player is not None:
+            player_quiz = player.active_quiz
+            if player.team_name == '':
+                if player_quiz.player_set.filter(team_name=body).exists():
+                    return 'Sorry that name is taken!'
+                else:
+                    return SMSBot.pick_team(body, player)
+
+            elif player_quiz.current_question_index == 0:
+                return SMSBot.pre_quiz(body, player)
+
+            else:
+                # Player is answering the question
+                # Optional, send players their score after every question
+                # SMSBot.send(f'Your current score is: {player.points}/{len(question_set)}', from_)
+                return SMSBot.evaluate_answer(body, player)
+
+        else:
+            fetch_quiz = ActiveTriviaQuiz.objects.select_related('trivia_quiz').filter(session_code=body).first()
+            if fetch_quiz is not None:
+                return SMSBot.register_with_code(from_, fetch_quiz)
+            else:
+                msg = ('This number has not started any quizzes. '
+                       'Please send a valid session code to start!'
+                       )
+                return msg
+
     @staticmethod
     def send_quiz_invite(number, active_trivia_quiz):
         intro = (f'Hello! You\'ve been invited to play {active_trivia_quiz.trivia_quiz.name}'
@@ -177,6 +299,14 @@ class SMSBot:
         SMSBot.register(number, active_trivia_quiz)
 
 
+def twiml(reply=None):
+    """twiml builds the webhook response body, texting 'reply' back to the sender if given"""
+    response = MessagingResponse()
+    if reply:
+        response.message(reply)
+    return str(response)
+
+
 @csrf_exempt
 def sms_reply(request):
     """sms_reply is a handler method that triggers when the url 'sms' is
@@ -194,44 +324,41 @@ def sms_reply(request):
     # Get details about the message that just came in
     from_ = request.POST.get('From', None)
     body = request.POST.get('Body', None)
-
-    # check if the text is from a registered Player, can be null
-    player = Player.objects.filter(phone_number=from_)
-    available_quizzes = ActiveTriviaQuiz.objects.all()
-    session_codes = [q.session_code for q in available_quizzes]
-
-    if body.upper() == '!QUIT':
-        SMSBot.player_quit(player)
-        return redirect('/')
-
-    if player.exists():
-        player = player.first()
-        player_quiz = player.active_quiz
-        if player.team_name == '':
-            team_names = [t.team_name for t in Player.objects.all()]
-            if body in team_names:
-                SMSBot.send('Sorry that name is taken!', from_)
-            else:
-                SMSBot.pick_team(body, player)
-
-        elif player_quiz.current_question_index == 0:
-            SMSBot.pre_quiz(body, player)
-
-        else:
-            # Player is answering the question
-            SMSBot.evaluate_answer(body, player)
-            # Optional, send players their score after every question
-            # SMSBot.send(f'Your current score is: {player.points}/{len(question_set)}', from_)
-
-    elif body in session_codes:
-        fetch_quiz = available_quizzes.get(session_code=body)
-        SMSBot.register_with_code(from_, fetch_quiz)
-
-    else:
-        msg = ('This number has not started any quizzes. '
-               'Please send a valid session code to start!'
-               )
-        SMSBot.send(msg, from_)
-
-    # no page to display, sorry :(, redirect to another
-    return redirect('/')
+    message_sid = request.POST.get('MessageSid', None)
+
+    # a retry of a text we already processed gets the same reply and touches nothing
+    if message_sid and not SeenMessages.claim(message_sid):
+        done, reply = SeenMessages.wait_for_reply(message_sid, settings.SMS_DEDUPE_WAIT)
+        if not done:
+            # the first delivery is still being processed, an error makes twilio try again later
+            return HttpResponse(status=409)
+        return HttpResponse(twiml(reply), content_type='text/xml')
+
+    try:
+        reply = SMSBot.receive(from_, body)
+    except Exception:
+        if message_sid:
+            SeenMessages.release(message_sid)
+        raise
+    if message_sid:
+        SeenMessages.record_reply(message_sid, reply)
+
+    # the reply rides back on the webhook response, no extra api call and no page to render
+    return HttpResponse(twiml(reply), content_type='text/xml')
+
+
+@login_required
+def batch_status(request, batch):
+    """batch_status lets the host page follow the delivery of a broadcast,
+    it starts the question timer once nothing is left to send. Only the host
+    of the session the batch went to can see it, it lists phone numbers"""
+    players = Player.objects.filter(active_quiz__session_master=request.user)
+    if not OutboundMessage.objects.filter(batch=batch, recipient__in=players.values('phone_number')).exists():
+        raise Http404('No such batch')
+    report = OutboundMessage.batch_report(batch)
+    return JsonResponse({
+        'remaining': report[OutboundMessage.PENDING] + report[OutboundMessage.SENDING],
+        'sent': report[OutboundMessage.SENT],
+        'failed': report[OutboundMessage.FAILED],
+        'projected_seconds': OutboundMessage.projected_delivery(batch),
+    })
@@ -23,7 +23,7 @@ def register(request):
 
 @login_required
 def profile(request):
-    user_quizzes = TriviaQuiz.objects.filter(author=request.user)
+    user_quizzes = TriviaQuiz.objects.filter(author=request.user).select_related('author__profile')
     current_hosted_session = ActiveTriviaQuiz.objects.filter(session_master=request.user)
     return render(request, 'users/profile.html', {'user': request.user,
                                                   'user_quizzes': user_quizzes,
@@ -32,7 +32,7 @@ def profile(request):
 
 def profile_user(request, username):
     user = User.objects.get(username=username)
-    user_quizzes = TriviaQuiz.objects.filter(author=user)
+    user_quizzes = TriviaQuiz.objects.filter(author=user).select_related('author__profile')
     current_hosted_session = ActiveTriviaQuiz.objects.filter(session_master=request.user)
     return render(request, 'users/profile.html', {'user': request.user,
                                                   'user_quizzes': user_quizzes,